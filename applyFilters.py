@@ -1,64 +1,91 @@
-import filters, random
-
-def apply_random_filters(image):
-    
-    #face filters must be first
-    if random.random() < 0.5:
-        image = filters.text_filter(image)
-    if random.random() < 0.25:
-        image = filters.swirl_filter(image)
-
-    # soft filters
-    if random.random() < 0.2:
-        image = filters.contrast_filter(image)
-    if random.random() < 0.2:
-        image = filters.saturation_filter(image)
-    if random.random() < 0.2:
-        image = filters.affineTransform_filter(image)
-    if random.random() < 0.2:
-        image = filters.vintage_filter(image)
-
-    # medium filters (alt least one must be applied)
-    medium_filter = False
-    while medium_filter == False:
-        if random.random() < 0.15:
-            image = filters.sharpening_filter(image)
-            medium_filter = True
-        if random.random() < 0.15:
-            image = filters.glitch_shapes_filter(image)
-            medium_filter = True
-        if random.random() < 0.15:
-            image = filters.rotation_filter(image)
-            medium_filter = True
-        if random.random() < 0.15:
-            if random.random() < 0.5:
-                filters.green_schimmer_filter(image)
-            else:
-                filters.pink_schimmer_filter(image)
-            medium_filter = True
-        if random.random() < 0.1:
-            image = filters.radial_filter(image)
-            medium_filter = True
-        if random.random() < 0.1:
-            image = filters.color_filter(image)
-            medium_filter = True
-        #if random.random() < 0.05:
-        #    image = filters.folding_filter(image)
-        #    medium_filter = True
-        if random.random() < 0.05:
-            image = filters.wave_filter(image)
-            medium_filter = True
-    
-    # heavy filters
-    if random.random() < 0.05:
-        image = filters.random_color_shift_filter(image)
-    if random.random() < 0.05:
-        image = filters.broken_rainbow_filter(image)
-    #if random.random() < 0.05:
-    #    image = filters.pattern_filter(image)
-    if random.random() < 0.05:
-        image = filters.cursed_filter(image)
-    if random.random() < 0.02:
-        image = filters.threshold_filter(image)
-
-    return image
+import random
+from time import perf_counter
+
+import numpy as np
+
+import captureCache
+import filterRegistry
+import recipe
+import tiling
+from colorLut import as_rgb_uint8
+
+
+class FilterChain:
+    # the filters may overwrite their input, so the chain works on its own copy
+    def __init__(self, image):
+        self.image = np.array(as_rgb_uint8(image))
+        self.lut = None
+
+    def apply(self, filter, *args):
+        self.flush()
+        self.image = filter(self.image, *args)
+
+    def color(self, lut):
+        # consecutive colour filters are merged into one table and applied in one pass
+        if self.lut is not None and not self.lut.fuses(lut):
+            self.flush()
+        self.lut = lut if self.lut is None else self.lut.then(lut)
+
+    def flush(self):
+        if self.lut is not None:
+            self.image = self.lut.apply(self.image, out=self.image)
+            self.lut = None
+        return self.image
+
+
+def apply_recipe(image, faces, variant, timings=None, full_shape=None, cache=None):
+    # timings collects (name, seconds) for filterRegistry.record_costs,
+    # full_shape is the size of the capture when image is a scaled down copy of it,
+    # cache is the captureCache.CaptureCache of the capture
+    chain = FilterChain(image)
+    pending = []
+    # every filter gets its own seed, so the random numbers of one do not depend on
+    # how many the filters before it drew at this size
+    seeds = random.Random(variant.seed)
+    full_shape = tuple((full_shape or image.shape)[:2])
+    factor = (image.shape[0] / full_shape[0], image.shape[1] / full_shape[1])
+
+    def flush():
+        start = perf_counter()
+        chain.flush()
+        if pending and timings is not None:
+            timings.append((filterRegistry.LUT_APPLY, perf_counter() - start))
+        pending.clear()
+
+    # counted as busy, so single filters know how many cores they may split over
+    with tiling.rendering(), captureCache.using(cache):
+        for name in variant.chain:
+            spec = filterRegistry.registry[name]
+            if spec.kind == filterRegistry.LUT:
+                pending.append(name)
+            elif spec.kind != filterRegistry.DISCARDED:
+                flush()
+            # folding and wave crop the frame, the filters after them refer to the
+            # cropped full size frame
+            shape = chain.image.shape
+            full = tuple(round(size / f) for size, f in zip(shape[:2], factor))
+            start = perf_counter()
+            with recipe.replaying(seeds.randrange(2**32), shape, full):
+                spec.apply(chain, faces)
+            if timings is not None:
+                timings.append((name, perf_counter() - start))
+        flush()
+    return chain.image
+
+
+def apply_chain(image, faces, names, timings=None):
+    return apply_recipe(image, faces, recipe.Recipe(names, recipe.new_seed()), timings)
+
+
+def apply_random_filters(image, faces=None, budget=None):
+    table = filterRegistry.cost_table(image.shape)
+    return apply_chain(image, faces, filterRegistry.pick_chain(table, budget))
+
+
+def warm_up(shape):
+    # runs every filter once, so imports, kernels and font caches are ready before the first coin
+    image = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    faces = [{'r': shape[0] // 4, 'c': shape[1] // 4, 'width': shape[1] // 2, 'height': shape[0] // 2}]
+    for spec in filterRegistry.FILTERS:
+        if spec.probability > 0:
+            apply_chain(image, faces, [spec.name])
@@ -0,0 +1,223 @@
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+import tracing
+
+# archives of one directory share the first characters of their session id
+SHARD_CHARS = 2
+# status() of the disk, the booth stops taking photos when it is full
+OK = "ok"
+LOW = "low"
+FULL = "full"
+STATUS_TEXT = {OK: "in Ordnung", LOW: "knapp", FULL: "voll"}
+# answers of Apache that mean the visitor got the archive
+DOWNLOAD_STATUSES = ("200", "206", "304")
+ARCHIVE_NAME = re.compile(r"^[0-9a-f-]{36}\.zip$")
+
+
+class ArchiveStore:
+    # the session archives under root/<first id characters>/<id>.zip, with an sqlite
+    # index of their size, creation and download time. Archives older than max_age
+    # seconds are removed in the background, and the oldest ones, downloaded first,
+    # while the archives take more than max_bytes or less than twice min_free_bytes
+    # are free, so the booth only stops below min_free_bytes if nothing is left to delete
+    def __init__(self, root, index_path, max_age=None, max_bytes=None, min_free_bytes=0):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        os.makedirs(root, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.last_status = OK
+        self.db = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS archives (id TEXT PRIMARY KEY, path TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created REAL NOT NULL, downloaded REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS archives_created ON archives (created)")
+        self.reconcile()
+
+    def relative_path(self, session_id):
+        # also the path in the download URL
+        return "{}/{}.zip".format(session_id[:SHARD_CHARS], session_id)
+
+    def path(self, session_id):
+        path = os.path.join(self.root, self.relative_path(session_id))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def add(self, session_id, path):
+        size = os.path.getsize(path)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO archives (id, path, size, created) VALUES (?, ?, ?, ?)",
+                (session_id, os.path.relpath(path, self.root), size, time.time())
+            )
+            self.count += 1
+            self.bytes += size
+        self.publish()
+        if self.over_quota():
+            self.wakeup.set()
+
+    def mark_downloaded(self, session_id, when=None):
+        with self.lock:
+            self.db.execute(
+                "UPDATE archives SET downloaded = ? WHERE id = ? AND downloaded IS NULL",
+                (when or time.time(), session_id)
+            )
+
+    def stats(self):
+        # counters kept in memory and one statvfs, cheap enough for every coin
+        with self.lock:
+            count, size = self.count, self.bytes
+        return {"archives": count, "bytes": size, "free_bytes": shutil.disk_usage(self.root).free}
+
+    def status(self):
+        free = shutil.disk_usage(self.root).free
+        if free < self.min_free_bytes:
+            status = FULL
+        elif self.over_quota():
+            status = LOW
+        else:
+            status = OK
+        if status != OK:
+            self.wakeup.set()
+        if status != self.last_status:
+            print("Archivspeicher {} ({:.0f} MB frei)".format(STATUS_TEXT[status], free / 2**20))
+            self.last_status = status
+        return status
+
+    def over_quota(self):
+        with self.lock:
+            size = self.bytes
+        if self.max_bytes is not None and size > self.max_bytes:
+            return True
+        return shutil.disk_usage(self.root).free < 2 * self.min_free_bytes
+
+    def evict(self, now=None):
+        now = now or time.time()
+        removed = 0
+        if self.max_age is not None:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT id, path, size FROM archives WHERE created < ?", (now - self.max_age,)
+                ).fetchall()
+            removed += self.remove(rows)
+        while self.over_quota():
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT id, path, size FROM archives ORDER BY downloaded IS NULL, created LIMIT 1"
+                ).fetchall()
+            if not rows:
+                break
+            removed += self.remove(rows)
+        if removed:
+            print("{} alte Archive gelöscht".format(removed))
+        return removed
+
+    def remove(self, rows):
+        for session_id, path, size in rows:
+            try:
+                os.remove(os.path.join(self.root, path))
+            except FileNotFoundError:
+                pass
+            with self.lock:
+                self.db.execute("DELETE FROM archives WHERE id = ?", (session_id,))
+                self.count -= 1
+                self.bytes -= size
+        self.publish()
+        return len(rows)
+
+    def reconcile(self):
+        # archives that disappeared leave the index, archives that are not in it yet,
+        # like the flat <id>.zip files of older versions, are taken in where they are
+        # so their download links keep working
+        with self.lock:
+            known = dict(self.db.execute("SELECT path, id FROM archives").fetchall())
+        for path, session_id in known.items():
+            if not os.path.exists(os.path.join(self.root, path)):
+                with self.lock:
+                    self.db.execute("DELETE FROM archives WHERE id = ?", (session_id,))
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                full_path = os.path.join(directory, name)
+                if name.startswith(".") and name.endswith(".part"):
+                    # left over by a crash, no session is running yet
+                    os.remove(full_path)
+                elif ARCHIVE_NAME.match(name) and os.path.relpath(full_path, self.root) not in known:
+                    stat = os.stat(full_path)
+                    with self.lock:
+                        self.db.execute(
+                            "INSERT OR IGNORE INTO archives (id, path, size, created) VALUES (?, ?, ?, ?)",
+                            (name[:-4], os.path.relpath(full_path, self.root), stat.st_size, stat.st_mtime)
+                        )
+        with self.lock:
+            self.count, self.bytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM archives").fetchone()
+        self.publish()
+
+    def publish(self):
+        stats = self.stats()
+        tracing.set_gauge(tracing.ARCHIVES, stats["archives"])
+        tracing.set_gauge(tracing.ARCHIVE_BYTES, stats["bytes"])
+
+    def start(self, interval=60):
+        def run():
+            while True:
+                self.wakeup.wait(interval)
+                self.wakeup.clear()
+                try:
+                    self.evict()
+                except (OSError, sqlite3.Error) as error:
+                    print("Archive nicht aufgeräumt: {}".format(error))
+
+        threading.Thread(target=run, name="archive eviction", daemon=True).start()
+
+    def follow_downloads(self, log_path, poll=2):
+        # reads "<seconds> <status> <path>" lines of the Apache download log,
+        # see etc/apache2/conf-available/local-schnappi.conf
+        def run():
+            file = None
+            while True:
+                if file is None:
+                    try:
+                        file = open(log_path, "rb")
+                    except OSError:
+                        time.sleep(poll * 10)
+                        continue
+                line = file.readline()
+                if line.endswith(b"\n"):
+                    self.read_download(line.decode("utf-8", errors="replace"))
+                    continue
+                if line:
+                    # the rest of the line is still being written
+                    file.seek(-len(line), os.SEEK_CUR)
+                time.sleep(poll)
+                try:
+                    stat = os.stat(log_path)
+                    if stat.st_ino != os.fstat(file.fileno()).st_ino or stat.st_size < file.tell():
+                        # rotated or truncated, start with the new file
+                        file.close()
+                        file = None
+                except OSError:
+                    pass
+
+        threading.Thread(target=run, name="download log", daemon=True).start()
+
+    def read_download(self, line):
+        parts = line.split()
+        if len(parts) != 3 or parts[1] not in DOWNLOAD_STATUSES:
+            return
+        name = parts[2].rsplit("/", 1)[-1]
+        if ARCHIVE_NAME.match(name):
+            try:
+                self.mark_downloaded(name[:-4], float(parts[0]))
+            except ValueError:
+                pass
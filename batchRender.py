@@ -0,0 +1,132 @@
+import argparse
+import os
+import shutil
+import sys
+from time import monotonic, sleep
+
+import skimage as ski
+
+from colorLut import as_rgb_uint8
+from filterEngine import create_filter_engine
+from jpegEncoder import SUBSAMPLING, JpegEncoder
+from pipeline import SessionPipeline
+from session import Session, remove_stale_sessions
+import tracing
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def image_paths(source):
+    # a directory, or one path per line on stdin for "-"
+    if source == "-":
+        for line in sys.stdin:
+            if line.strip():
+                yield line.strip()
+        return
+    for name in sorted(os.listdir(source)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            yield os.path.join(source, name)
+
+
+def read_image(path):
+    image = ski.io.imread(path)
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = image[..., :3]
+    return as_rgb_uint8(image)
+
+
+class BatchRenderer:
+    def __init__(self, output_dir, variants, backend, workers, budget, max_sessions, download_url, archive_original,
+                 encoder=None, encode_workers=2, thumbnail_height=None):
+        self.output_dir = output_dir
+        self.variants = variants
+        self.thumbnail_height = thumbnail_height
+        self.finished = 0
+        self.engine = create_filter_engine(backend, workers, budget)
+        self.pipeline = SessionPipeline(
+            self.engine, variants, output_dir, download_url, max_sessions, self.session_finished, archive_original,
+            encoder=encoder, encode_workers=encode_workers, thumbnail_height=thumbnail_height
+        )
+
+    def session_finished(self, session):
+        # same layout as on the booth: <id>.zip next to a folder with the single images
+        target = os.path.join(self.output_dir, session.id)
+        os.makedirs(target, exist_ok=True)
+        for image_counter in range(1, self.variants + 1):
+            shutil.copy(session.image_path(image_counter), target)
+            if self.thumbnail_height:
+                shutil.copy(session.thumbnail_path(image_counter), target)
+        session.cleanup()
+        self.finished += 1
+
+    def render(self, path):
+        image = read_image(path)
+        while not self.pipeline.begin():
+            sleep(0.05)
+        session = Session()
+        print("{} -> {}".format(path, session.archive_name))
+        self.pipeline.submit(session, image)
+
+    def wait(self):
+        while self.pipeline.in_flight:
+            sleep(0.05)
+
+    def close(self):
+        self.engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendert Fotos aus einem Ordner ohne Kamera, GPIO und GUI.")
+    parser.add_argument("source", help="Ordner mit Bildern oder - für Pfade von stdin")
+    parser.add_argument("output", help="Zielordner für Archive und Bilder")
+    parser.add_argument("--variants", type=int, default=4, help="Varianten pro Bild")
+    parser.add_argument("--backend", choices=("process", "thread"), default="process")
+    parser.add_argument("--workers", type=int, help="Größe des Filter-Pools, Standard: alle Kerne")
+    parser.add_argument("--budget", type=float, help="Sekunden, die eine Variante höchstens dauern soll")
+    parser.add_argument("--queue", type=int, default=2, help="Bilder gleichzeitig in der Pipeline")
+    parser.add_argument("--url", default="http://10.42.0.1/img/{}", help="Download-Adresse für den QR-Code")
+    parser.add_argument("--original", action="store_true", help="Original mit ins Archiv packen")
+    parser.add_argument("--quality", type=int, default=75, help="JPEG-Qualität")
+    parser.add_argument("--subsampling", choices=tuple(SUBSAMPLING), default="4:2:0", help="Farbunterabtastung")
+    parser.add_argument("--progressive", action="store_true", help="progressive JPEGs schreiben")
+    parser.add_argument("--optimize", action="store_true", help="Huffman-Tabellen optimieren")
+    parser.add_argument("--encoders", type=int, default=2, help="Threads, die JPEGs schreiben")
+    parser.add_argument("--thumbnails", type=int, help="zusätzlich kleine JPEGs in dieser Höhe")
+    parser.add_argument("--metrics", help="Zeiten pro Stufe und Filter im Prometheus-Textformat in diese Datei schreiben")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    remove_stale_sessions()
+    encoder = JpegEncoder(args.quality, args.subsampling, args.progressive, args.optimize)
+    print(encoder)
+    renderer = BatchRenderer(
+        args.output, args.variants, args.backend, args.workers, args.budget, args.queue, args.url, args.original,
+        encoder, args.encoders, args.thumbnails
+    )
+    start = monotonic()
+    submitted = 0
+    try:
+        for path in image_paths(args.source):
+            try:
+                renderer.render(path)
+            except (OSError, ValueError) as error:
+                print("{} übersprungen: {}".format(path, error))
+                continue
+            submitted += 1
+        renderer.wait()
+    finally:
+        renderer.close()
+
+    elapsed = monotonic() - start
+    images = renderer.finished * args.variants
+    print("{} von {} Fotos fertig, {} Bilder in {:.1f}s ({:.2f} Bilder/s)".format(
+        renderer.finished, submitted, images, elapsed, images / elapsed if elapsed else 0
+    ))
+    if args.metrics:
+        tracing.write(args.metrics)
+    if renderer.finished < submitted:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
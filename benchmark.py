@@ -0,0 +1,169 @@
+import argparse
+import inspect
+import json
+import platform
+import random
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+import skimage as ski
+
+import faceFilters
+import filters
+import recipe
+import warpMaps
+from applyFilters import apply_random_filters
+
+FRAME_SHAPE = (1080, 1920)
+SAMPLE_IMAGES = ("astronaut", "coffee", "chelsea")
+
+
+def synthetic_frame(seed):
+    # gradients, a few shapes and sensor noise, the same on every machine
+    rng = np.random.default_rng(seed)
+    rows, cols = FRAME_SHAPE
+    y, x = np.mgrid[0:rows, 0:cols]
+    frame = np.stack([x / cols, y / rows, 1 - x / cols], axis=-1) * 200
+    shapes, _ = ski.draw.random_shapes(FRAME_SHAPE, max_shapes=12, min_size=50, rng=seed)
+    frame = frame * 0.6 + shapes * 0.4 + rng.normal(0, 4, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def sample_frame(name):
+    image = getattr(ski.data, name)()
+    return ski.util.img_as_ubyte(ski.transform.resize(image, FRAME_SHAPE, anti_aliasing=True))
+
+
+def load_frames(kinds, seed):
+    frames = {}
+    if "synthetic" in kinds:
+        frames["synthetic"] = synthetic_frame(seed)
+    if "sample" in kinds:
+        for name in SAMPLE_IMAGES:
+            frames[name] = sample_frame(name)
+    for frame in frames.values():
+        frame.flags.writeable = False
+    return frames
+
+
+def benchmark_functions():
+    # every *_filter function of the two filter modules, face filters take the detected faces
+    functions = {}
+    for module in (faceFilters, filters):
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            if name.endswith("_filter") and function.__module__ == module.__name__:
+                functions[name] = function
+    functions["apply_random_filters"] = apply_random_filters
+    return functions
+
+
+def call(function, image, faces, seed=None):
+    # the filters draw their parameters from the recipe, apply_random_filters its chain from random
+    random.seed(seed)
+    with recipe.replaying(seed, image.shape):
+        if "faces" in inspect.signature(function).parameters:
+            return function(image, faces)
+        return function(image)
+
+
+def measure(function, frame, faces, runs, seed):
+    latencies = []
+    minor_faults = []
+    for run in range(runs):
+        # the filters may overwrite their input, so every call gets its own copy
+        image = frame.copy()
+        faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+        start = time.perf_counter()
+        call(function, image, faces, seed + run)
+        latencies.append(time.perf_counter() - start)
+        minor_faults.append(resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults)
+
+    # tracemalloc slows numpy down, so the peak gets a run of its own
+    image = frame.copy()
+    tracemalloc.start()
+    call(function, image, faces, seed)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "runs": runs,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+        "peak_mb": peak / 2**20,
+        # fresh pages the filter touched, a cheap stand-in for its allocations
+        "minor_faults": int(np.median(minor_faults)),
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print("\nVergleich mit Baseline (p50 / Spitze):")
+    for key, result in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        latency = result["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] else 0
+        memory = result["peak_mb"] / old["peak_mb"] - 1 if old["peak_mb"] else 0
+        marker = ""
+        if latency > threshold or memory > threshold:
+            marker = "  <-- schlechter"
+            regressions.append(key)
+        print("{:45s} {:+7.1%} {:+7.1%}{}".format(key, latency, memory, marker))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Misst Laufzeit und Speicher der Filter ohne Kamera und GPIO.")
+    parser.add_argument("--runs", type=int, default=5, help="Messläufe pro Filter und Bild")
+    parser.add_argument("--chains", type=int, default=20, help="Läufe von apply_random_filters pro Bild")
+    parser.add_argument("--frames", nargs="+", choices=("synthetic", "sample"), default=["synthetic", "sample"])
+    parser.add_argument("--only", nargs="+", help="nur diese Filter messen")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-{}.json".format(time.strftime("%Y%m%d-%H%M%S")))
+    parser.add_argument("--baseline", help="frühere Ergebnisdatei zum Vergleich")
+    parser.add_argument("--threshold", type=float, default=0.1, help="erlaubte Verschlechterung, 0.1 = 10%%")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames, args.seed)
+    functions = benchmark_functions()
+    if args.only:
+        functions = {name: functions[name] for name in args.only}
+    # the warp maps are built once per boot on the booth, that is not what we measure here
+    warpMaps.prepare(FRAME_SHAPE)
+
+    results = {}
+    print("{:45s} {:>9s} {:>9s} {:>10s} {:>12s}".format("Filter", "p50 ms", "p95 ms", "Spitze MB", "Seitenfehler"))
+    for frame_name, frame in frames.items():
+        faces = faceFilters.detect_faces(frame)
+        for name, function in functions.items():
+            runs = args.chains if function is apply_random_filters else args.runs
+            # the first call loads warp maps and face positions, it is not counted
+            call(function, frame.copy(), faces)
+            key = "{}/{}".format(frame_name, name)
+            results[key] = measure(function, frame, faces, runs, args.seed)
+            print("{:45s} {p50_ms:9.1f} {p95_ms:9.1f} {peak_mb:10.1f} {minor_faults:12d}".format(key, **results[key]))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "skimage": ski.__version__,
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print("Ergebnisse gespeichert in {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
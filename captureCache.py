@@ -0,0 +1,53 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import tracing
+
+# the cache of the capture the current thread renders, None outside of a render
+local = threading.local()
+
+
+class CaptureCache:
+    # intermediates of one capture that several of its renders need, like the swirl maps
+    # around its faces, as files in the session directory on tmpfs, so the preview and
+    # every variant map the same read-only copy in whatever worker process they run,
+    # and they go with the session
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def count(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        with self.lock:
+            return self.hits, self.misses
+
+    def report(self):
+        hits, misses = self.stats()
+        tracing.increment(tracing.CAPTURE_CACHE_LOOKUPS, hits, result="hit")
+        tracing.increment(tracing.CAPTURE_CACHE_LOOKUPS, misses, result="miss")
+        print("Zwischenergebnisse: {} wiederverwendet, {} berechnet".format(hits, misses))
+
+
+def current():
+    return getattr(local, "cache", None)
+
+
+@contextmanager
+def using(cache):
+    previous = current()
+    local.cache = cache
+    try:
+        yield
+    finally:
+        local.cache = previous
@@ -0,0 +1,135 @@
+import numpy as np
+import skimage as ski
+
+# cube tables sample every colour channel at this many evenly spaced levels, 0 and 255
+# included, and interpolate between them
+CUBE_SIZE = 65
+# pixels interpolated at once, keeps the temporary arrays small
+CUBE_CHUNK = 1 << 16
+
+
+def as_rgb_uint8(image):
+    if image.dtype != np.uint8:
+        if image.dtype.kind == 'f':
+            image = np.clip(image, 0, 1)
+        image = ski.util.img_as_ubyte(image)
+    if image.ndim == 2:
+        image = ski.color.gray2rgb(image)
+    return image
+
+
+def cube_position_tables():
+    # maps every channel value to the lower lattice level below it and how far it is
+    # on the way to the next one
+    positions = np.arange(256) * (CUBE_SIZE - 1) / 255
+    levels = np.minimum(positions.astype(np.intp), CUBE_SIZE - 2)
+    fractions = (positions - levels).astype(np.float32)
+    return np.stack([levels] * 3), np.stack([fractions] * 3)
+
+
+def cube_lattice():
+    # the colour of every lattice point, laid out as a (CUBE_SIZE ** 3, 1, 3) image
+    levels = np.round(np.arange(CUBE_SIZE) * 255 / (CUBE_SIZE - 1)).astype(np.uint8)
+    r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+    return np.stack([r, g, b], axis=-1).reshape(-1, 1, 3)
+
+
+class ChannelLut:
+    # one 256 entry table per colour channel
+    def __init__(self, table):
+        self.table = np.ascontiguousarray(table, dtype=np.uint8)
+
+    @classmethod
+    def from_function(cls, function):
+        # evaluates a per-pixel filter on every possible value of each channel
+        ramp = np.repeat(np.arange(256, dtype=np.uint8).reshape(256, 1, 1), 3, axis=2)
+        return cls(as_rgb_uint8(function(ramp)).reshape(256, 3).T)
+
+    def apply(self, image, out=None):
+        # out may be the image itself
+        image = as_rgb_uint8(image)
+        if out is None:
+            out = np.empty_like(image)
+        for channel in range(3):
+            self.table[channel].take(image[..., channel], out=out[..., channel], mode='clip')
+        return out
+
+    def fuses(self, lut):
+        return True
+
+    def then(self, lut):
+        if isinstance(lut, ChannelLut):
+            return ChannelLut([lut.table[channel].take(self.table[channel]) for channel in range(3)])
+        # runs the channel tables in front of the cube as part of its position lookup
+        return CubeLut(lut.table, (
+            np.stack([lut.level_tables[channel].take(self.table[channel]) for channel in range(3)]),
+            np.stack([lut.fraction_tables[channel].take(self.table[channel]) for channel in range(3)]),
+        ), lut.post)
+
+
+class CubeLut:
+    # cross-channel mappings, sampled on a CUBE_SIZE ** 3 lattice and interpolated
+    # trilinearly in between, positions are (level tables, fraction tables) per channel,
+    # post is a ChannelLut that runs on the interpolated colours
+    def __init__(self, table, positions=None, post=None):
+        self.table = np.ascontiguousarray(table, dtype=np.uint8)
+        self.values = self.table.astype(np.float32)
+        self.level_tables, self.fraction_tables = cube_position_tables() if positions is None else positions
+        self.post = post
+
+    @classmethod
+    def from_function(cls, function):
+        return cls(as_rgb_uint8(function(cube_lattice())).reshape(-1, 3))
+
+    def apply(self, image, out=None):
+        # out may be the image itself, every chunk is read before it is written
+        image = as_rgb_uint8(image)
+        if out is None:
+            out = np.empty_like(image)
+        pixels = image.reshape(-1, 3)
+        result = out.reshape(-1, 3)
+        for start in range(0, len(pixels), CUBE_CHUNK):
+            chunk = pixels[start:start + CUBE_CHUNK]
+            self.interpolate(chunk, result[start:start + CUBE_CHUNK])
+        return out
+
+    def interpolate(self, pixels, out):
+        steps = (CUBE_SIZE * CUBE_SIZE, CUBE_SIZE, 1)
+        index = self.level_tables[0].take(pixels[:, 0]) * steps[0]
+        index += self.level_tables[1].take(pixels[:, 1]) * steps[1]
+        index += self.level_tables[2].take(pixels[:, 2])
+        fractions = [self.fraction_tables[channel].take(pixels[:, channel])[:, np.newaxis] for channel in range(3)]
+
+        def corner(offset):
+            return self.values.take(index + offset, axis=0)
+
+        def lerp(low, high, fraction):
+            high -= low
+            high *= fraction
+            low += high
+            return low
+
+        # along blue, then green, then red
+        planes = [
+            lerp(corner(r + g), corner(r + g + 1), fractions[2])
+            for r in (0, steps[0]) for g in (0, steps[1])
+        ]
+        rows = [lerp(planes[0], planes[1], fractions[1]), lerp(planes[2], planes[3], fractions[1])]
+        value = lerp(rows[0], rows[1], fractions[0])
+        value += 0.5
+        np.copyto(out, value, casting='unsafe')
+        if self.post is not None:
+            for channel in range(3):
+                self.post.table[channel].take(out[:, channel], out=out[:, channel], mode='clip')
+
+    def fuses(self, lut):
+        # a cube after the post tables would sample them on the lattice
+        return self.post is None or isinstance(lut, ChannelLut)
+
+    def then(self, lut):
+        positions = (self.level_tables, self.fraction_tables)
+        if isinstance(lut, ChannelLut):
+            # channel tables like color wrap around, so they run after the interpolation
+            return CubeLut(self.table, positions, lut if self.post is None else self.post.then(lut))
+        # the lattice itself is a tiny image of colours, the next cube maps it like any other
+        return CubeLut(lut.apply(self.table.reshape(-1, 1, 3)).reshape(-1, 3), positions, lut.post)
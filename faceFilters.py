@@ -1,60 +1,103 @@
 import skimage as ski
 import numpy as np
-import random
-import matplotlib
-import matplotlib.pyplot as plt
-
 from PIL import Image
-
-matplotlib.use("agg")
+import recipe
+import textOverlay
+import warpMaps
 
 def convert_image(image):
     image_uint8 = (image * 255).astype(np.uint8)
     return image_uint8
 
-def face_detection(image):
-    # startregion Face detection
-    trained_file = ski.data.lbp_frontal_face_cascade_filename()
-    detector = ski.feature.Cascade(trained_file)
-    detected = detector.detect_multi_scale(
-        img=image, scale_factor=1.2, step_ratio=1, min_size=(100, 100), max_size=(1000, 1000)
-    )
-    center_x = 0
-    center_y = 0
-
-    # get x, y
-    for face in detected:
-        # Calculate the center of the face
-        center_y = face['r'] + face['width'] // 2
-        center_x = face['c'] + face['height'] // 2
-        return center_x, center_y   # only return the first face
-    else:
+# detection runs on a copy scaled down to about this width
+DETECTION_WIDTH = 480
+
+class FaceDetector:
+    def __init__(self):
+        trained_file = ski.data.lbp_frontal_face_cascade_filename()
+        self.detector = ski.feature.Cascade(trained_file)
+
+    def detect(self, image, full_shape=None):
+        # image may be a scaled down copy of a full_shape frame, face sizes and
+        # results always refer to the full frame
+        factor = max(1, image.shape[1] // DETECTION_WIDTH)
+        if factor > 1:
+            # box average in uint8, without a full size float copy of the frame
+            small = np.asarray(Image.fromarray(np.ascontiguousarray(image)).reduce(factor))
+        else:
+            small = image
+        rows, cols = (full_shape or image.shape)[:2]
+        scale_r, scale_c = rows / small.shape[0], cols / small.shape[1]
+        detected = self.detector.detect_multi_scale(
+            img=small, scale_factor=1.2, step_ratio=1,
+            min_size=(round(100 / scale_r), round(100 / scale_c)),
+            max_size=(round(1000 / scale_r), round(1000 / scale_c))
+        )
+        # scale the results back to the full frame
+        return [
+            {'r': round(face['r'] * scale_r), 'c': round(face['c'] * scale_c),
+             'width': round(face['width'] * scale_c), 'height': round(face['height'] * scale_r)}
+            for face in detected
+        ]
+
+face_detector = None
+
+def load_face_detector():
+    global face_detector
+    if face_detector is None:
+        face_detector = FaceDetector()
+    return face_detector
+
+def detect_faces(image, full_shape=None):
+    return load_face_detector().detect(image, full_shape)
+
+def face_centers(image, faces=None):
+    if faces is None:
+        faces = detect_faces(image)
+
+    # get x, y of every face
+    centers = [(face['c'] + face['width'] // 2, face['r'] + face['height'] // 2) for face in faces]
+    if not centers:
         #if there are no faces found
-        height, width = image.shape[:2]
-        center_x = width // 2
-        center_y = height // 2
-        return center_x, center_y
-
-def swirl_filter(image):
-    x, y = face_detection(image)
-    image = ski.transform.swirl(image, strength=random.uniform(-5,5), radius=random.uniform(1400,1500), center=(x, y))
-    return convert_image(image)
-
-def random_schnappi_text():
-    with open('schnappi_text.txt', 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-    random_line = random.choice(lines)
-    return random_line.strip()
-
-def text_filter(image):
-    fig = plt.figure()
-    fig.figimage(image, resize=True)
-    x, y = face_detection(image)
-    height, width = image.shape[:2]
-    fig.text(x=(x/width), y=(y/height)-0.1, s=random_schnappi_text(), fontsize=random.uniform(20,32), ha="center", va="center", color=(random.uniform(0,1),random.uniform(0,1),random.uniform(0,1)), rotation=random.uniform(-45,45))
-    fig.canvas.draw()
-    annotated_img = np.asarray(fig.canvas.renderer.buffer_rgba())
-    plt.close(fig)
-    pil_image = Image.fromarray(annotated_img)
-    rgb_image = pil_image.convert('RGB')
-    return np.array(rgb_image)
\ No newline at end of file
+        height, width = recipe.full_shape(image.shape)
+        centers.append((width // 2, height // 2))
+    return centers
+
+# face positions are rounded to this many pixels, so nearby faces share a swirl map
+SWIRL_CENTER_STEP = 16
+
+def swirl_coords(shape, rng, center=None):
+    if center is None:
+        center = (shape[1] // 2, shape[0] // 2)
+    strength = rng.uniform(-5,5)
+    radius = rng.uniform(1400,1500)
+    return ski.transform.warp_coords(
+        lambda xy: warpMaps.swirl_mapping(xy, center, 0, strength, radius), shape
+    )
+
+warpMaps.register("swirl", swirl_coords, mode='reflect')
+
+def swirl_filter(image, faces=None):
+    if faces is None:
+        faces = detect_faces(image)
+    if not faces:
+        # the maps around the image centre are cached on disk like the other distortions
+        return warpMaps.apply_preset("swirl", image)
+    # one of the faces, the same one at every render size of the recipe
+    x, y = recipe.rng().choice(face_centers(image, faces))
+    center = (SWIRL_CENTER_STEP * round(x / SWIRL_CENTER_STEP), SWIRL_CENTER_STEP * round(y / SWIRL_CENTER_STEP))
+    return warpMaps.apply_preset("swirl", image, center)
+
+def text_filter(image, faces=None):
+    # faces and sizes refer to the full frame, smaller renders scale them down
+    height = recipe.full_shape(image.shape)[0]
+    scale = recipe.scale()
+    rng = recipe.rng()
+    # a caption for every face
+    for x, y in face_centers(image, faces):
+        size = rng.uniform(20,32) * textOverlay.POINTS_TO_PIXELS * scale
+        color = (rng.randint(0,255), rng.randint(0,255), rng.randint(0,255))
+        # the caption goes a little below the face
+        center = (x * scale, (y + 0.1 * height) * scale)
+        textOverlay.draw_caption(image, textOverlay.random_caption(rng), center, size, color, rng.uniform(-45,45))
+    return image
@@ -0,0 +1,93 @@
+import threading
+from time import monotonic
+
+import faceFilters
+
+# share of a new detection in the smoothed face position and size
+SMOOTHING = 0.5
+# detections a face may be missing from before it is dropped
+MAX_MISSES = 2
+
+
+def center(face):
+    return face['c'] + face['width'] / 2, face['r'] + face['height'] / 2
+
+
+class FaceTracker:
+    # runs the cascade a few times per second on small grayscale preview frames while
+    # it is started, the faces are kept smoothed and in full_shape coordinates so
+    # the filters can use them for the still without detecting again
+    def __init__(self, full_shape, rate=3):
+        self.full_shape = tuple(full_shape[:2])
+        self.interval = 1 / rate
+        self.condition = threading.Condition()
+        self.active = False
+        self.frame = None
+        self.due = 0
+        self.tracks = []
+        self.detections = 0
+        threading.Thread(target=self.run, name="face tracker", daemon=True).start()
+
+    def start(self):
+        with self.condition:
+            self.active = True
+            self.frame = None
+            self.due = 0
+            self.tracks = []
+            self.detections = 0
+
+    def stop(self):
+        # the faces of the last frames, None if there was no detection yet
+        with self.condition:
+            self.active = False
+            self.frame = None
+            return self.faces_locked()
+
+    def wants_frame(self):
+        return self.active and self.frame is None and monotonic() >= self.due
+
+    def put(self, frame):
+        with self.condition:
+            if self.active:
+                self.frame = frame
+                self.condition.notify()
+
+    def faces(self):
+        with self.condition:
+            return self.faces_locked()
+
+    def faces_locked(self):
+        if self.detections == 0:
+            return None
+        return [{key: round(track[key]) for key in ('r', 'c', 'width', 'height')} for track in self.tracks]
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.frame is None:
+                    self.condition.wait()
+                frame = self.frame
+                self.frame = None
+                self.due = monotonic() + self.interval
+            faces = faceFilters.detect_faces(frame, self.full_shape)
+            with self.condition:
+                if self.active:
+                    self.update(faces)
+
+    def update(self, faces):
+        # every detection moves the closest track within its size, the others start new ones
+        unmatched = list(self.tracks)
+        for face in faces:
+            x, y = center(face)
+            track = min(unmatched, key=lambda t: (center(t)[0] - x) ** 2 + (center(t)[1] - y) ** 2, default=None)
+            if track is not None and abs(center(track)[0] - x) < track['width'] and abs(center(track)[1] - y) < track['height']:
+                unmatched.remove(track)
+                for key in ('r', 'c', 'width', 'height'):
+                    track[key] += SMOOTHING * (face[key] - track[key])
+                track['misses'] = 0
+            else:
+                self.tracks.append(dict(face, misses=0))
+        for track in unmatched:
+            track['misses'] += 1
+        self.tracks = [track for track in self.tracks if track['misses'] <= MAX_MISSES]
+        self.detections += 1
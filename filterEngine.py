@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import skimage as ski
+
+import filterRegistry
+import tiling
+from applyFilters import apply_recipe, warm_up
+from captureCache import CaptureCache
+
+# small frame every filter is run on once at startup so the first session
+# does not pay for imports and first-call setup
+WARM_UP_SHAPE = (240, 320, 3)
+
+
+def as_uint8(image):
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype.kind == 'f':
+        image = np.clip(image, 0, 1)
+    return ski.util.img_as_ubyte(image)
+
+
+def _render_recipe(image, faces, variant, full_shape=None, cache=None):
+    timings = []
+    return apply_recipe(image, faces, variant, timings, full_shape, cache), timings
+
+
+class ThreadFilterEngine:
+    # budget: seconds a single variant may take, None for no limit
+    def __init__(self, workers=None, budget=None):
+        self.budget = budget
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        warm_up(WARM_UP_SHAPE)
+
+    def plan(self, count, shape):
+        return filterRegistry.plan_recipes(count, shape, self.budget)
+
+    def render(self, image, faces, recipes, full_shape=None, trace=None, cache=None):
+        # full_shape: size of the capture when image is a scaled down preview of it,
+        # trace: tracing.Trace of the session that gets the filter timings,
+        # cache: captureCache.CaptureCache shared by all renders of the capture
+        futures = {
+            self.executor.submit(_render_recipe, image, faces, variant, full_shape, cache): n
+            for n, variant in enumerate(recipes, start=1)
+        }
+        for future in as_completed(futures):
+            filtered_image, timings = future.result()
+            filterRegistry.record_costs(image.shape, timings)
+            if trace is not None:
+                trace.add_filters(timings)
+            yield futures[future], as_uint8(filtered_image)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def _init_worker(busy):
+    # every worker is forked from the same state, so the filters would all roll the same dice
+    random.seed()
+    np.random.seed()
+    # a worker only splits a filter over the cores the other workers leave free
+    tiling.share_counter(busy)
+
+
+def _warm_up():
+    warm_up(WARM_UP_SHAPE)
+    return os.getpid()
+
+
+def _render_shared(source_name, shape, dtype, faces, variant, full_shape, target_name, cache_dir):
+    # the cache comes as its directory, its counts go back with the result
+    cache = CaptureCache(cache_dir) if cache_dir is not None else None
+    source = shared_memory.SharedMemory(name=source_name)
+    target = shared_memory.SharedMemory(name=target_name)
+    try:
+        image = np.ndarray(shape, dtype, buffer=source.buf)
+        image.flags.writeable = False
+        filtered_image, timings = _render_recipe(image, faces, variant, full_shape, cache)
+        filtered_image = np.ascontiguousarray(as_uint8(filtered_image))
+        if filtered_image.nbytes > target.size:
+            raise ValueError("filtered image does not fit into the shared result buffer")
+        np.ndarray(filtered_image.shape, filtered_image.dtype, buffer=target.buf)[...] = filtered_image
+        result = filtered_image.shape, filtered_image.dtype.str, timings, cache.stats() if cache is not None else (0, 0)
+        # views on the shared buffers must be gone before they can be closed
+        del image, filtered_image
+        return result
+    finally:
+        source.close()
+        target.close()
+
+
+class ProcessFilterEngine:
+    def __init__(self, workers=None, budget=None):
+        self.budget = budget
+        self.workers = workers or os.cpu_count()
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["filterEngine"])
+        self.context = context
+        self.busy = context.Value('i', 0)
+        self.lock = threading.Lock()
+        self.executor = self.start_pool()
+
+    def start_pool(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=self.context, initializer=_init_worker, initargs=(self.busy,)
+        )
+        # start and warm up all workers now instead of on the first coin
+        for future in [executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def restart(self, broken):
+        # a worker died, e.g. killed for memory, and took the pool with it,
+        # only the first render that notices starts a new one
+        with self.lock:
+            if self.executor is broken:
+                print("Filter-Prozess abgestürzt, starte die Filter neu")
+                broken.shutdown(wait=False, cancel_futures=True)
+                with self.busy.get_lock():
+                    self.busy.value = 0
+                self.executor = self.start_pool()
+
+    def plan(self, count, shape):
+        # planned here, where the measured costs of all workers come together
+        return filterRegistry.plan_recipes(count, shape, self.budget)
+
+    def render(self, image, faces, recipes, full_shape=None, trace=None, cache=None):
+        numbered = list(enumerate(recipes, start=1))
+        done = set()
+        executor = self.executor
+        try:
+            for n, filtered_image in self.render_on(executor, image, faces, numbered, full_shape, trace, cache):
+                done.add(n)
+                yield n, filtered_image
+        except BrokenProcessPool:
+            self.restart(executor)
+            # once more on the new pool, without the variants that were already handed out,
+            # if that breaks too the session fails
+            executor = self.executor
+            numbered = [(n, variant) for n, variant in numbered if n not in done]
+            try:
+                yield from self.render_on(executor, image, faces, numbered, full_shape, trace, cache)
+            except BrokenProcessPool:
+                self.restart(executor)
+                raise
+
+    def render_on(self, executor, image, faces, numbered, full_shape, trace, cache):
+        image = np.ascontiguousarray(image)
+        source = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        targets = {n: shared_memory.SharedMemory(create=True, size=image.nbytes) for n, _ in numbered}
+        try:
+            np.ndarray(image.shape, image.dtype, buffer=source.buf)[...] = image
+            futures = {
+                executor.submit(
+                    _render_shared, source.name, image.shape, image.dtype.str, faces, variant, full_shape, targets[n].name,
+                    cache.directory if cache is not None else None
+                ): n
+                for n, variant in numbered
+            }
+            for future in as_completed(futures):
+                n = futures[future]
+                shape, dtype, timings, cache_stats = future.result()
+                if cache is not None:
+                    cache.count(*cache_stats)
+                filterRegistry.record_costs(image.shape, timings)
+                if trace is not None:
+                    trace.add_filters(timings)
+                yield n, np.ndarray(shape, dtype, buffer=targets[n].buf).copy()
+        finally:
+            for block in [source] + list(targets.values()):
+                block.close()
+                block.unlink()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def create_filter_engine(backend, workers=None, budget=None):
+    if backend == "process":
+        return ProcessFilterEngine(workers, budget)
+    if backend == "thread":
+        return ThreadFilterEngine(workers, budget)
+    raise ValueError("unknown filter backend: {}".format(backend))
@@ -0,0 +1,174 @@
+import random
+import threading
+
+import filters
+from recipe import Recipe, new_seed
+from tiling import Tiling
+
+CATEGORIES = ("face", "soft", "medium", "heavy")
+
+# how a filter joins the chain: run on the image, or fused as a colour table
+FILTER = "filter"
+LUT = "lut"
+# colour table that depends on the image it is applied to
+IMAGE_LUT = "image_lut"
+# rolled like the others, but the result was never used, so the image stays as it is
+DISCARDED = "discarded"
+
+# a fused colour table costs one pass over the image, whatever it contains
+LUT_APPLY = "lut_apply"
+# new measurements replace this share of the old estimate
+COST_WEIGHT = 0.3
+REFERENCE_PIXELS = 1080 * 1920
+
+
+class FilterSpec:
+    # tiling: a tiling.Tiling for filters that can run in horizontal strips
+    def __init__(self, name, category, function, probability, kind=FILTER, faces=False, tiling=None):
+        self.name = name
+        self.category = category
+        self.function = function
+        self.probability = probability
+        self.kind = kind
+        self.faces = faces
+        self.tiling = tiling
+
+    def apply(self, chain, faces):
+        if self.kind == DISCARDED:
+            return
+        if self.kind == LUT:
+            chain.color(self.function())
+        elif self.kind == IMAGE_LUT:
+            chain.color(self.function(chain.flush()))
+        elif self.faces:
+            chain.apply(self.function, faces)
+        elif self.tiling is not None:
+            chain.apply(self.tiling.apply)
+        else:
+            chain.apply(self.function)
+
+
+# in chain order, face filters must be first
+FILTERS = [
+    FilterSpec("text", "face", filters.text_filter, 0.5, faces=True),
+    FilterSpec("swirl", "face", filters.swirl_filter, 0.25, faces=True),
+
+    FilterSpec("contrast", "soft", filters.contrast_lut, 0.2, LUT),
+    FilterSpec("saturation", "soft", filters.saturation_lut, 0.2, LUT),
+    FilterSpec("affineTransform", "soft", filters.affineTransform_filter, 0.2),
+    FilterSpec("vintage", "soft", filters.vintage_filter, 0.2,
+               tiling=Tiling(filters.vintage_params, filters.vintage_strip, filters.vintage_halo)),
+
+    # at least one medium filter is applied
+    FilterSpec("sharpening", "medium", filters.sharpening_filter, 0.15,
+               tiling=Tiling(filters.sharpening_params, filters.sharpening_strip, filters.sharpening_halo)),
+    FilterSpec("glitch_shapes", "medium", filters.glitch_shapes_filter, 0.15),
+    FilterSpec("rotation", "medium", filters.rotation_filter, 0.15),
+    # green or pink, rolled together with 0.15, counts as the medium filter
+    FilterSpec("schimmer", "medium", filters.schimmer_filter, 0.15, DISCARDED),
+    FilterSpec("radial", "medium", filters.radial_filter, 0.1),
+    FilterSpec("color", "medium", filters.color_lut, 0.1, LUT),
+    FilterSpec("folding", "medium", filters.folding_filter, 0.05),
+    FilterSpec("wave", "medium", filters.wave_filter, 0.05),
+
+    FilterSpec("random_color_shift", "heavy", filters.random_color_shift_lut, 0.05, LUT),
+    FilterSpec("broken_rainbow", "heavy", filters.broken_rainbow_lut, 0.05, IMAGE_LUT),
+    # too slow for the booth
+    FilterSpec("pattern", "heavy", filters.pattern_filter, 0),
+    FilterSpec("cursed", "heavy", filters.cursed_filter, 0.05),
+    FilterSpec("threshold", "heavy", filters.threshold_filter, 0.02),
+]
+registry = {spec.name: spec for spec in FILTERS}
+
+# seconds at 1920x1080 from benchmark.py, only used until a filter was measured at that size
+DEFAULT_COSTS = {
+    "text": 0.01, "swirl": 0.15,
+    "contrast": 0.002, "saturation": 0.2, "affineTransform": 0.13, "vintage": 0.23,
+    "sharpening": 0.6, "glitch_shapes": 0.36, "rotation": 0.15, "schimmer": 0.0,
+    "radial": 0.13, "color": 0.002, "folding": 0.13, "wave": 0.13,
+    "random_color_shift": 0.002, "broken_rainbow": 0.005, "pattern": 12.0, "cursed": 0.9,
+    "threshold": 0.05, LUT_APPLY: 0.03,
+}
+
+costs = {}
+lock = threading.Lock()
+
+
+def cost_table(shape):
+    shape = tuple(shape[:2])
+    with lock:
+        table = costs.get(shape)
+        if table is None:
+            scale = shape[0] * shape[1] / REFERENCE_PIXELS
+            table = costs[shape] = {name: cost * scale for name, cost in DEFAULT_COSTS.items()}
+        return dict(table)
+
+
+def record_costs(shape, timings):
+    # timings are (name, seconds) pairs from apply_chain
+    cost_table(shape)
+    with lock:
+        table = costs[tuple(shape[:2])]
+        for name, seconds in timings:
+            table[name] += COST_WEIGHT * (seconds - table[name])
+
+
+def chain_cost(names, table):
+    total = 0
+    fused = False
+    for name in names:
+        if registry[name].kind == DISCARDED:
+            continue
+        lut = registry[name].kind != FILTER
+        if fused and not lut:
+            total += table[LUT_APPLY]
+        total += table[name]
+        fused = lut
+    if fused:
+        total += table[LUT_APPLY]
+    return total
+
+
+def pick_chain(table, budget=None, rng=random):
+    # same categories and odds as before, filters that would break the budget are left out
+    chain = []
+
+    def fits(spec):
+        return budget is None or chain_cost(chain + [spec.name], table) <= budget
+
+    def roll(specs):
+        picked = False
+        for spec in specs:
+            if rng.random() < spec.probability and fits(spec):
+                chain.append(spec.name)
+                picked = True
+        return picked
+
+    by_category = {category: [spec for spec in FILTERS if spec.category == category] for category in CATEGORIES}
+    roll(by_category["face"])
+    roll(by_category["soft"])
+    medium = by_category["medium"]
+    if any(fits(spec) for spec in medium):
+        while not roll(medium):
+            pass
+    else:
+        chain.append(min(medium, key=lambda spec: table[spec.name]).name)
+    roll(by_category["heavy"])
+    return chain
+
+
+def plan_chains(count, shape, budget=None, rng=random, candidates=4):
+    # the slowest variant holds up the session, so the other chains are picked
+    # from a few candidates to take about as long as a randomly drawn first one
+    table = cost_table(shape)
+    first = pick_chain(table, budget, rng)
+    target = chain_cost(first, table)
+    options = [pick_chain(table, budget, rng) for _ in range((count - 1) * candidates)]
+    options.sort(key=lambda names: abs(chain_cost(names, table) - target))
+    chains = [first] + options[:count - 1]
+    rng.shuffle(chains)
+    return chains
+
+
+def plan_recipes(count, shape, budget=None):
+    return [Recipe(chain, new_seed()) for chain in plan_chains(count, shape, budget)]
@@ -1,15 +1,22 @@
 import skimage as ski
+# skimage loads its submodules on first use, which is not thread safe, and the
+# strip filters may touch them first on a tiling thread
+import skimage.filters
+import skimage.morphology
+import skimage.util
 import numpy as np
-import random
 
-from skimage.transform import PiecewiseAffineTransform, warp
+import recipe
+import warpMaps
+from skimage.transform import PiecewiseAffineTransform
+from colorLut import ChannelLut, CubeLut, as_rgb_uint8
 from faceFilters import swirl_filter, text_filter
 
 # Alle Filter die man benutzen kann:
 #image = filters.swirl_filter(image)
 #image = filters.text_filter(image)
 #image = filters.wave_filter(image)
-#image = filters.folding_filter(image) # raus genommen, weil zu langsam
+#image = filters.folding_filter(image)
 #image = filters.radial_filter(image)
 #image = filters.cursed_filter(image)
 #image = filters.color_filter(image)
@@ -26,6 +33,14 @@ from faceFilters import swirl_filter, text_filter
 #image = filters.vintage_filter(image)
 #image = filters.green_schimmer_filter(image)
 #image = filters.pink_schimmer_filter(image)
+#image = filters.schimmer_filter(image) # grün oder rosa
+#
+# Die reinen Farbfilter gibt es auch als Tabelle (*_lut), aufeinanderfolgende
+# Tabellen fasst apply_random_filters zu einer zusammen.
+#
+# Alle Filter bekommen und liefern ein uint8-Bild der Form (H, W, 3) mit Werten
+# 0..255. Sie dürfen ihr Eingabebild überschreiben, apply_random_filters gibt
+# ihnen dafür eine eigene Kopie.
 
 
 # startregion definitions
@@ -33,52 +48,67 @@ def convert_image(image):
     image_uint8 = (image * 255).astype(np.uint8)
     return image_uint8
 
-def radial_distortion(xy):
+def to_float(image):
+    # float32 in [0, 1] for the skimage filters that need floats, half the size of float64
+    return ski.util.img_as_float32(image)
+
+def to_uint8(image, out=None):
+    # back to the chain format, scales the float image in place and writes into out if it fits
+    image *= 255
+    np.clip(image, 0, 255, out=image)
+    if out is None or out.shape != image.shape:
+        return image.astype(np.uint8)
+    np.copyto(out, image, casting='unsafe')
+    return out
+
+def radial_distortion(xy, k1, k2):
     xy_c = xy.max(axis=0) / 2
     xy = (xy - xy_c) / xy_c
     radius = np.linalg.norm(xy, axis=1)
-    k1 = random.uniform(0.7, 1.0)
-    k2 = random.uniform(0.2, 0.4)
     distortion_model = (1 + k1 * radius + k2 * radius**2) * k2
     xy *= distortion_model.reshape(-1, 1)
     xy = xy * xy_c + xy_c
     return xy
 
 def biased_random(min, max):
-    # This will make lower numbers more likely
-    x = np.random.power(0.5)
+    # This will make lower numbers more likely, same as np.random.power(0.5)
+    x = recipe.rng().random() ** 2
     # Scale the number to the range [min, max]
     return min + ((max-1.0) * x)
 # endregion
 
 # startregion filters
-def wave_filter(image):
-    rows, cols = image.shape[0], image.shape[1]
-    src_cols = np.linspace(0, cols, random.randint(3,20))
+# the distortion filters pick one of warpMaps.PRESETS precomputed coordinate maps
+def wave_coords(shape, rng):
+    rows, cols = shape
+    src_cols = np.linspace(0, cols, rng.randint(3,20))
     src_rows = np.linspace(0, rows, 10)
     src_rows, src_cols = np.meshgrid(src_rows, src_cols)
     src = np.dstack([src_cols.flat, src_rows.flat])[0]
     # add sinusoidal oscillation to row coordinates
-    dst_rows = src[:, 1] - np.sin(np.linspace(0, 3 * np.pi, src.shape[0])) * random.randint(100,200)
+    dst_rows = src[:, 1] - np.sin(np.linspace(0, 3 * np.pi, src.shape[0])) * rng.randint(100,200)
     dst_cols = src[:, 0]
     dst_rows *= 1.5
-    dst_rows -= 1.5 * random.randint(10,100)
+    dst_rows -= 1.5 * rng.randint(10,100)
     dst = np.vstack([dst_cols, dst_rows]).T
     tform = PiecewiseAffineTransform()
     tform.estimate(src, dst)
-    out_rows = image.shape[0] - 1.5 * 50
+    out_rows = int(rows - 1.5 * 50)
     out_cols = cols
-    out = warp(image, tform, output_shape=(out_rows, out_cols))
-    return convert_image(out)
+    return ski.transform.warp_coords(tform, (out_rows, out_cols))
 
-def folding_filter(image):
-    rows, cols = image.shape[0], image.shape[1]
+def wave_filter(image):
+    return warpMaps.apply_preset("wave", image)
+
+def folding_coords(shape, rng):
+    rows, cols = shape
+    np_rng = np.random.RandomState(rng.getrandbits(32))
     
     # Randomize the source columns and rows
-    num_cols = random.randint(10, 40)
-    num_rows = random.randint(10, 20)
-    src_cols = np.random.choice(np.arange(cols), num_cols, replace=False)
-    src_rows = np.random.choice(np.arange(rows), num_rows, replace=False)
+    num_cols = rng.randint(10, 40)
+    num_rows = rng.randint(10, 20)
+    src_cols = np_rng.choice(np.arange(cols), num_cols, replace=False)
+    src_rows = np_rng.choice(np.arange(rows), num_rows, replace=False)
     src_rows, src_cols = np.meshgrid(src_rows, src_cols)
     src = np.dstack([src_cols.flat, src_rows.flat])[0]
     
@@ -94,92 +124,229 @@ def folding_filter(image):
 
     out_rows = int(rows - 1.5 * 50)  # Ensure out_rows is an integer
     out_cols = cols
-    out = warp(image, tform, output_shape=(out_rows, out_cols))
-    return convert_image(out)
+    return ski.transform.warp_coords(tform, (out_rows, out_cols))
 
+def folding_filter(image):
+    return warpMaps.apply_preset("folding", image)
+
+def radial_coords(shape, rng):
+    k1 = rng.uniform(0.7, 1.0)
+    k2 = rng.uniform(0.2, 0.4)
+    return ski.transform.warp_coords(lambda xy: radial_distortion(xy, k1, k2), shape)
 
 def radial_filter(image):
-    image = warp(image, radial_distortion, cval=0.5)
-    return convert_image(image)
+    return warpMaps.apply_preset("radial", image)
 
 
+def hsv_plane(image, plane):
+    # hue (0) or saturation (1) of ski.color.rgb2hsv in float32, without the other planes
+    red, green, blue = (to_float(image[..., channel]) for channel in range(3))
+    value = np.maximum(np.maximum(red, green), blue)
+    delta = value - np.minimum(np.minimum(red, green), blue)
+    if plane == 1:
+        return np.divide(delta, value, out=np.zeros_like(delta), where=value != 0)
+    gray = delta == 0
+    delta[gray] = 1
+    hue = green - blue
+    hue /= delta
+    # the later cases win where two channels are the maximum, as in skimage
+    for offset, first, second, maximum in ((2, blue, red, green), (4, red, green, blue)):
+        mask = maximum == value
+        hue[mask] = offset + (first[mask] - second[mask]) / delta[mask]
+    hue /= 6
+    hue %= 1
+    hue[gray] = 0
+    return hue
+
 def cursed_filter(image):
-    hsv_img = ski.color.rgb2hsv(image)
-    hue_img = hsv_img[:, :, random.randint(-1,1)]
-    rgb_image = ski.color.gray2rgb(hue_img)
-    return convert_image(rgb_image)
+    # hue wraps around between red and magenta, a lattice would blur it into gray
+    plane = recipe.rng().randint(-1,1) % 3
+    if plane == 2:
+        # the value is the brightest channel, exact in uint8
+        np.maximum(np.maximum(image[..., 0], image[..., 1]), image[..., 2], out=image[..., 0])
+        image[..., 1:] = image[..., :1]
+        return image
+    plane = hsv_plane(image, plane)
+    plane *= 255
+    np.copyto(image, plane[..., np.newaxis], casting='unsafe')
+    return image
 
-def color_filter(image):
+def color_lut():
     multiplier = [0,0,0]
-    rand1 = random.randint(0, 2)
-    rand2 = random.randint(0, 2)
+    rand1 = recipe.rng().randint(0, 2)
+    rand2 = recipe.rng().randint(0, 2)
     multiplier[rand1] = 1
     multiplier[rand2] = 1
-    image = image * multiplier
-    return convert_image(image)
+    return ChannelLut.from_function(lambda image: convert_image(image * multiplier))
+
+def color_filter(image):
+    return color_lut().apply(image)
+
+def random_color_shift_lut():
+    multiplier = [recipe.rng().uniform(-1, 1),recipe.rng().uniform(-1, 1),recipe.rng().uniform(-1, 1)]
+    return ChannelLut.from_function(lambda image: convert_image(image + multiplier))
 
 def random_color_shift_filter(image):
-    multiplier = [random.uniform(-1, 1),random.uniform(-1, 1),random.uniform(-1, 1)]
-    image = image + multiplier
-    return convert_image(image)
+    return random_color_shift_lut().apply(image)
 
 def glitch_shapes_filter(image):
-    height, width = image.shape[:2]
+    # the shapes are drawn at full size, so a smaller render shows the same ones
+    height, width = recipe.full_shape(image.shape)
     shape_image, _ = ski.draw.random_shapes(
-        (height, width), min_shapes=5, max_shapes=10, min_size=20, allow_overlap=True
+        (height, width), min_shapes=5, max_shapes=10, min_size=20, allow_overlap=True,
+        rng=recipe.rng().getrandbits(32)
     )
-    rotated_shapes = ski.transform.swirl(shape_image, rotation=random.uniform(-5.0, 5.0))
-    return image + convert_image(rotated_shapes)
+    if shape_image.shape[:2] != image.shape[:2]:
+        rows = np.linspace(0, height - 1, image.shape[0]).round().astype(np.intp)
+        cols = np.linspace(0, width - 1, image.shape[1]).round().astype(np.intp)
+        shape_image = shape_image[rows[:, np.newaxis], cols]
+    # same mapping as the rotation filter
+    rotated_shapes = warpMaps.apply_preset("rotation", shape_image)
+    # the wrap-around is the glitch: the white background only shifts the image by one
+    return np.add(image, rotated_shapes, out=image)
+
+def broken_rainbow_lut(image):
+    # the mapping depends on the value range of the image it is applied to
+    image = as_rgb_uint8(image)
+    in_range = (int(image.min()), int(image.max()))
+    out_range = (0, recipe.rng().uniform(0.4, 2.5) * np.pi)
+    def broken_rainbow(image):
+        image = ski.exposure.rescale_intensity(image, in_range=in_range, out_range=out_range)
+        image_wrapped = np.angle(np.exp(1j * image))
+        return convert_image(image_wrapped)
+    return ChannelLut.from_function(broken_rainbow)
 
 def broken_rainbow_filter(image):
-    image = ski.exposure.rescale_intensity(image, out_range=(0, random.uniform(0.4, 2.5) * np.pi))
-    image_wrapped = np.angle(np.exp(1j * image))
-    return convert_image(image_wrapped)
+    return broken_rainbow_lut(image).apply(image)
 
 def pattern_filter(image):
-    labels1 = ski.segmentation.slic(image, compactness=random.randint(1,50), n_segments=random.randint(100,1000), start_label=1)
-    image = ski.color.label2rgb(labels1, image, kind='avg', bg_label=0)
-    return image
+    labels1 = ski.segmentation.slic(image, compactness=recipe.rng().randint(1,50), n_segments=recipe.rng().randint(100,1000), start_label=1)
+    # averaging keeps the uint8 dtype of the image
+    return ski.color.label2rgb(labels1, image, kind='avg', bg_label=0)
+
+def contrast_lut():
+    gamma = recipe.rng().uniform(0.1, 5)
+    return ChannelLut.from_function(lambda image: ski.exposure.adjust_gamma(image, gamma=gamma))
 
 def contrast_filter(image):
-    image = ski.exposure.adjust_gamma(image, gamma=random.uniform(0.1, 5))
-    return image
+    return contrast_lut().apply(image)
+
+def saturation_lut():
+    saturation_factor = recipe.rng().uniform(0.1, 3)
+    def saturation(image):
+        image = ski.color.rgb2hsv(image)
+        image[..., 1] = np.clip(image[..., 1] * saturation_factor, 0, 1)
+        image = ski.color.hsv2rgb(image)
+        return convert_image(image)
+    return CubeLut.from_function(saturation)
 
 def saturation_filter(image):
-    saturation_factor = random.uniform(0.1, 3)
-    image = ski.color.rgb2hsv(image)
-    image[..., 1] = np.clip(image[..., 1] * saturation_factor, 0, 1)
-    image = ski.color.hsv2rgb(image)
-    return convert_image(image)
+    return saturation_lut().apply(image)
+
+# the filters below run in horizontal strips when cores are free, split into drawing
+# the random parameters, the work on one strip and the rows of context it needs
+def gaussian_halo(sigma, truncate=4.0):
+    # the kernel radius scipy uses, plus a row for rounding
+    return int(truncate * sigma + 0.5) + 1
+
+def sharpening_params():
+    radius = biased_random(0.0, 20.0)
+    # like vintage, the colour axis is not scaled
+    scale = recipe.scale()
+    return {'radius': (radius * scale, radius * scale, radius), 'amount': recipe.rng().uniform(-10.0, 10.0)}
+
+def sharpening_strip(image, radius, amount):
+    sharpened = ski.filters.unsharp_mask(to_float(image), radius, amount)
+    return to_uint8(sharpened, out=image)
+
+def sharpening_halo(radius, amount):
+    return gaussian_halo(radius[0])
 
 def sharpening_filter(image):
-    image = ski.filters.unsharp_mask(image, biased_random(0.0, 20.0), random.uniform(-10.0, 10.0))
-    return convert_image(image)
+    return sharpening_strip(image, **sharpening_params())
+
+def gray_uint8(image):
+    # rgb2gray weights in 8 bit fixed point
+    image = as_rgb_uint8(image)
+    gray = image[..., 0] * np.uint16(54)
+    gray += image[..., 1] * np.uint16(183)
+    gray += image[..., 2] * np.uint16(19)
+    return (gray >> 8).astype(np.uint8)
+
+def otsu_uint8(gray, nbins):
+    # skimage ignores nbins for integer images, so the 256 levels are binned over the
+    # value range like the float image would be
+    levels = np.arange(256) / 255
+    low, high = levels[gray.min()], levels[gray.max()]
+    if low == high:
+        return high
+    width = (high - low) / nbins
+    bins = np.clip(((levels - low) / width).astype(np.intp), 0, nbins - 1)
+    counts = np.bincount(bins, weights=np.bincount(gray.ravel(), minlength=256), minlength=nbins)
+    centers = low + width * (np.arange(nbins) + 0.5)
+    return ski.filters.threshold_otsu(hist=(counts, centers))
 
 def threshold_filter(image):
-    image = ski.color.rgb2gray(image)
-    thresh = ski.filters.threshold_otsu(image, nbins=random.randint(2,20))
-    image = image > thresh
-    return convert_image(image)
+    gray = gray_uint8(image)
+    thresh = otsu_uint8(gray, recipe.rng().randint(2,20))
+    lut = convert_image(np.arange(256) / 255 > thresh)
+    lut.take(gray, out=gray)
+    image[...] = gray[..., np.newaxis]
+    return image
+
+def rotation_coords(shape, rng):
+    # skimage.transform.swirl defaults: strength 1, radius 100 around the image centre
+    rows, cols = shape
+    rotation = rng.uniform(-5.0, 5.0)
+    return ski.transform.warp_coords(
+        lambda xy: warpMaps.swirl_mapping(xy, (cols / 2, rows / 2), rotation, 1, 100), shape
+    )
 
 def rotation_filter(image):
-    image = ski.transform.swirl(image, rotation=random.uniform(-5.0, 5.0))
-    return convert_image(image)
+    return warpMaps.apply_preset("rotation", image)
+
+def affineTransform_coords(shape, rng):
+    tform = ski.transform.AffineTransform(scale=(1, 1), rotation=rng.uniform(0.1,-0.1), shear=rng.uniform(-0.3,0.3))
+    return ski.transform.warp_coords(tform, shape)
 
 def affineTransform_filter(image):
-    tform = ski.transform.AffineTransform(scale=(1, 1), rotation=random.uniform(0.1,-0.1), shear=random.uniform(-0.3,0.3))
-    transformed_image = ski.transform.warp(image, tform)
-    return convert_image(transformed_image)
+    return warpMaps.apply_preset("affineTransform", image)
+
+def vintage_params():
+    # sigma 1 on the colour axis as well, mixing the channels is part of the look
+    scale = recipe.scale()
+    return {'sigma': (scale, scale, 1), 'mode': recipe.rng().choice(['reflect', 'constant', 'nearest', 'mirror', 'wrap']), 'cval': recipe.rng().uniform(-0.1,1), 'truncate': recipe.rng().uniform(0,4)}
+
+def vintage_strip(image, sigma, mode, cval, truncate):
+    blurred = ski.filters.gaussian(to_float(image), sigma=sigma, mode=mode, cval=cval, truncate=truncate)
+    return to_uint8(blurred, out=image)
+
+def vintage_halo(sigma, mode, cval, truncate):
+    # wrapping reaches over to the other end of the image
+    if mode == 'wrap':
+        return None
+    return gaussian_halo(sigma[0], truncate)
 
 def vintage_filter(image):
-    image = ski.filters.gaussian(image, mode=random.choice(['reflect', 'constant', 'nearest', 'mirror', 'wrap']), cval=random.uniform(-0.1,1), truncate=random.uniform(0,4))
-    return convert_image(image)
+    return vintage_strip(image, **vintage_params())
 
 def green_schimmer_filter(image):
-    image = ski.morphology.dilation(image, mode='constant', cval=random.uniform(0,250))
+    image = ski.morphology.dilation(image, mode='constant', cval=recipe.rng().uniform(0,250))
     return convert_image(image)
 
 def pink_schimmer_filter(image):
-    image = ski.morphology.erosion(image, mode='constant', cval=random.uniform(-250,250))
+    image = ski.morphology.erosion(image, mode='constant', cval=recipe.rng().uniform(-250,250))
     return convert_image(image)
-# endregion
\ No newline at end of file
+
+def schimmer_filter(image):
+    # one coin flip for both, then green or pink
+    if recipe.rng().random() < 0.5:
+        return green_schimmer_filter(image)
+    return pink_schimmer_filter(image)
+
+warpMaps.register("wave", wave_coords)
+warpMaps.register("folding", folding_coords)
+warpMaps.register("radial", radial_coords, cval=127)
+warpMaps.register("rotation", rotation_coords, mode='reflect')
+warpMaps.register("affineTransform", affineTransform_coords)
+# endregion
@@ -0,0 +1,49 @@
+import threading
+
+import numpy as np
+
+
+class FrameRing:
+    # the latest full size frames of the running stream with their sensor timestamps,
+    # copied into preallocated slots while it is started
+    def __init__(self, size, shape):
+        self.slots = [np.empty(shape, dtype=np.uint8) for _ in range(size)]
+        self.timestamps = [None] * size
+        self.next = 0
+        self.active = False
+        self.condition = threading.Condition()
+
+    def start(self):
+        with self.condition:
+            self.timestamps = [None] * len(self.slots)
+            self.active = True
+
+    def stop(self):
+        with self.condition:
+            self.active = False
+
+    def put(self, timestamp, frame):
+        with self.condition:
+            if not self.active:
+                return
+            slot = self.next
+            self.next = (slot + 1) % len(self.slots)
+            # not readable while it is overwritten
+            self.timestamps[slot] = None
+        np.copyto(self.slots[slot], frame)
+        with self.condition:
+            self.timestamps[slot] = timestamp
+            self.condition.notify_all()
+
+    def nearest(self, timestamp, timeout):
+        # waits for the first frame after timestamp, so the one before it can compete,
+        # returns (sensor timestamp, copy of the frame) or None if there was no frame
+        with self.condition:
+            self.condition.wait_for(
+                lambda: any(t is not None and t >= timestamp for t in self.timestamps), timeout
+            )
+            filled = [(abs(t - timestamp), slot) for slot, t in enumerate(self.timestamps) if t is not None]
+            if not filled:
+                return None
+            slot = min(filled)[1]
+            return self.timestamps[slot], self.slots[slot].copy()
@@ -0,0 +1,50 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# libjpeg-turbo without the PIL image round trip, used when it is installed and
+# the settings do not need PIL
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# chroma subsampling as PIL numbers it
+SUBSAMPLING = {"4:4:4": 0, "4:2:2": 1, "4:2:0": 2}
+
+
+class JpegEncoder:
+    # quality 75 with 4:2:0 is what ski.io.imsave used to write, progressive and
+    # optimize make the files a little smaller for two to four times the time
+    def __init__(self, quality=75, subsampling="4:2:0", progressive=False, optimize=False):
+        if subsampling not in SUBSAMPLING:
+            raise ValueError("unknown chroma subsampling: {}".format(subsampling))
+        self.quality = quality
+        self.subsampling = subsampling
+        self.progressive = progressive
+        self.optimize = optimize
+        self.fast = simplejpeg is not None and not progressive and not optimize
+
+    def encode(self, image):
+        image = np.ascontiguousarray(image)
+        if self.fast:
+            return simplejpeg.encode_jpeg(
+                image, quality=self.quality, colorspace='RGB', colorsubsampling=self.subsampling.replace(":", "")
+            )
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(
+            buffer, "JPEG", quality=self.quality, subsampling=SUBSAMPLING[self.subsampling],
+            progressive=self.progressive, optimize=self.optimize
+        )
+        return buffer.getvalue()
+
+    def encode_thumbnail(self, image, height):
+        width = round(image.shape[1] * height / image.shape[0])
+        small = Image.fromarray(np.ascontiguousarray(image)).resize((width, height), Image.BILINEAR, reducing_gap=2.0)
+        return self.encode(np.asarray(small))
+
+    def __repr__(self):
+        return "JpegEncoder(quality={}, subsampling={}, progressive={}, optimize={}, {})".format(
+            self.quality, self.subsampling, self.progressive, self.optimize, "simplejpeg" if self.fast else "PIL"
+        )
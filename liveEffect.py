@@ -0,0 +1,94 @@
+import random
+import threading
+from time import perf_counter
+
+import filterRegistry
+import recipe
+
+# filters that keep the frame size and are cheap enough for the camera preview
+LIVE_FILTERS = (
+    "text", "contrast", "saturation", "color", "random_color_shift",
+    "rotation", "radial", "affineTransform",
+)
+# new measurements replace this share of the cost estimate
+COST_WEIGHT = 0.2
+
+
+class LiveEffect:
+    # one filter with a fixed seed, applied to every preview frame in place. Effects that
+    # fit into the frame budget run on the camera thread, slower ones on a worker that
+    # always takes the newest frame, the frames in between show its last result
+    def __init__(self, full_shape, frame_budget=1 / 30):
+        self.full_shape = tuple(full_shape[:2])
+        self.frame_budget = frame_budget
+        # faces in full frame coordinates, for the text effect
+        self.faces = []
+        self.effect = None
+        self.cost = 0
+        self.pending = None
+        self.latest = None
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, name="live effect", daemon=True).start()
+
+    def start(self, name=None, seed=None):
+        name = name or random.choice(LIVE_FILTERS)
+        seed = recipe.new_seed() if seed is None else seed
+        effect = self.build(filterRegistry.registry[name], seed)
+        with self.condition:
+            self.effect = effect
+            self.cost = 0
+            self.pending = self.latest = None
+        return name
+
+    def stop(self):
+        with self.condition:
+            self.effect = None
+            self.pending = self.latest = None
+
+    def build(self, spec, seed):
+        if spec.kind == filterRegistry.LUT:
+            with recipe.replaying(seed, self.full_shape):
+                lut = spec.function()
+            return lambda frame: lut.apply(frame, out=frame)
+
+        def effect(frame):
+            # the same seed on every frame, so the effect does not flicker
+            with recipe.replaying(seed, frame.shape, self.full_shape):
+                if spec.faces:
+                    return spec.function(frame, self.faces)
+                return spec.function(frame)
+        return effect
+
+    def render(self, effect, frame):
+        start = perf_counter()
+        result = effect(frame)
+        if result is not frame:
+            frame[...] = result
+        self.cost += COST_WEIGHT * (perf_counter() - start - self.cost)
+
+    def process(self, frame):
+        # frame is an (H, W, 3) uint8 view on the camera buffer
+        with self.condition:
+            effect = self.effect
+            if effect is None:
+                return
+            if self.cost > self.frame_budget:
+                # any frame still waiting for the worker is dropped
+                self.pending = (effect, frame.copy())
+                self.condition.notify()
+                if self.latest is not None and self.latest.shape == frame.shape:
+                    frame[...] = self.latest
+                return
+        self.render(effect, frame)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                effect, frame = self.pending
+                self.pending = None
+            self.render(effect, frame)
+            with self.condition:
+                if self.effect is effect:
+                    self.latest = frame
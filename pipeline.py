@@ -0,0 +1,260 @@
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+import numpy as np
+import qrcode
+import skimage as ski
+from PIL import Image
+
+import faceFilters
+from captureCache import CaptureCache
+from jpegEncoder import JpegEncoder
+from sessionArchive import SessionArchive
+
+# passed down the per-image stages after the last image of a session
+SESSION_DONE = "done"
+SESSION_FAILED = "failed"
+
+
+def scaled_copy(image, height):
+    width = round(image.shape[1] * height / image.shape[0])
+    return np.asarray(Image.fromarray(image).resize((width, height), Image.BILINEAR, reducing_gap=2.0))
+
+
+class Stage(threading.Thread):
+    # every item starts with its session, on_error gets the session of an item the
+    # handler raised on
+    def __init__(self, name, handle, maxsize, on_error):
+        super().__init__(name=name, daemon=True)
+        self.handle = handle
+        self.on_error = on_error
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, *item):
+        # blocks while the stage is full, which holds back the stage in front of it
+        self.queue.put(item)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                self.handle(*item)
+            except Exception:
+                # the stage has to keep running for the next sessions
+                self.on_error(item[0])
+
+
+class SessionPipeline:
+    # capture -> filter -> encode -> archive -> qr, every stage runs in its own
+    # thread so the next session can be captured while the last one renders
+    # with on_preview set, every variant is first rendered preview_height pixels high
+    # and handed over in session.previews before the full size render starts
+    # the encode stage hands the images to encode_workers threads, each variant is also
+    # stored thumbnail_height pixels high if that is set
+    # with a store, the archives go into its shard directories instead of archive_dir
+    # on_failed gets every session that was given up after its slot was taken
+    def __init__(self, engine, variants, archive_dir, download_url, max_sessions, on_finished,
+                 archive_original=False, preview_height=None, on_preview=None,
+                 encoder=None, encode_workers=2, thumbnail_height=None, store=None, on_failed=None):
+        self.engine = engine
+        self.variants = variants
+        self.archive_dir = archive_dir
+        self.download_url = download_url
+        self.max_sessions = max_sessions
+        self.on_finished = on_finished
+        self.on_failed = on_failed
+        self.archive_original = archive_original
+        self.preview_height = preview_height
+        self.on_preview = on_preview
+        self.encoder = encoder or JpegEncoder()
+        self.thumbnail_height = thumbnail_height
+        self.store = store
+        self.encode_pool = ThreadPoolExecutor(max_workers=encode_workers, thread_name_prefix="encode")
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.started = {}
+        self.archives = {}
+        # encode jobs per session id, the end of a session waits for them
+        self.encoding = {}
+
+        self.filter_stage = Stage("filter", self.filter_session, max_sessions, self.fail)
+        self.encode_stage = Stage("encode", self.encode_image, variants + 1, self.fail)
+        self.archive_stage = Stage("archive", self.archive_image, 2 * variants + 2, self.fail)
+        self.qr_stage = Stage("qr", self.serve_session, max_sessions, self.fail)
+        for stage in (self.filter_stage, self.encode_stage, self.archive_stage, self.qr_stage):
+            stage.start()
+
+    def begin(self):
+        # reserves a slot for a session that is about to be captured
+        with self.lock:
+            if self.in_flight >= self.max_sessions:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def submit(self, session, image):
+        self.started[session.id] = monotonic()
+        self.filter_stage.put(session, image)
+
+    def fail(self, session):
+        traceback.print_exc()
+        self.drop(session)
+
+    def drop(self, session):
+        # gives the slot of a session that did not make it back, only once
+        if self.started.pop(session.id, None) is None:
+            return
+        self.abandon(session)
+
+    def abandon(self, session):
+        # also for a session whose capture failed before it was submitted
+        session.trace.finish("failed")
+        session.cleanup()
+        self.release()
+        if self.on_failed is not None:
+            try:
+                self.on_failed(session)
+            except Exception:
+                traceback.print_exc()
+
+    def filter_session(self, session, image):
+        trace = session.trace
+        try:
+            if image is None:
+                with trace.span("decode"):
+                    image = ski.io.imread(session.capture_path)
+                if self.archive_original:
+                    self.archive_stage.put(session, "original.jpg", session.capture_path)
+            elif self.archive_original:
+                self.encode_stage.put(session, "original.jpg", image)
+
+            faces = session.faces
+            if faces is None:
+                with trace.span("faces"):
+                    faces = faceFilters.detect_faces(image)
+            start = monotonic()
+            cache = CaptureCache(session.path("cache"))
+            # the same recipes give the same pictures at both sizes
+            with trace.span("plan"):
+                recipes = self.engine.plan(self.variants, image.shape)
+            if self.on_preview is not None:
+                with trace.span("preview"):
+                    previews = self.engine.render(
+                        scaled_copy(image, self.preview_height), faces, recipes, image.shape, cache=cache
+                    )
+                    session.previews = [preview for _, preview in sorted(previews, key=lambda item: item[0])]
+                print("Vorschau nach {:.2f}s".format(monotonic() - start))
+                self.on_preview(session)
+            # the encoder already works on the first variants while this span is open
+            with trace.span("filter"):
+                for image_counter, filtered_image in self.engine.render(image, faces, recipes, trace=trace, cache=cache):
+                    self.encode_stage.put(session, session.image_name(image_counter), filtered_image,
+                                          session.thumbnail_name(image_counter))
+            print("{} Bilder in {:.2f}s gefiltert".format(self.variants, monotonic() - start))
+            cache.report()
+        except Exception:
+            traceback.print_exc()
+            self.encode_stage.put(session, SESSION_FAILED, None)
+        else:
+            self.encode_stage.put(session, SESSION_DONE, None)
+
+    def encode_image(self, session, name, image, thumbnail_name=None):
+        # variants are encoded in the pool while the next ones are still rendering
+        if name in (SESSION_DONE, SESSION_FAILED):
+            for job in self.encoding.pop(session.id, []):
+                job.result()
+            self.archive_stage.put(session, name, None)
+            return
+        job = self.encode_pool.submit(self.encode_files, session, name, image, thumbnail_name)
+        self.encoding.setdefault(session.id, []).append(job)
+
+    def encode_files(self, session, name, image, thumbnail_name):
+        try:
+            with session.trace.span("encode"):
+                files = [(name, self.encoder.encode(image))]
+                if thumbnail_name is not None and self.thumbnail_height:
+                    files.append((thumbnail_name, self.encoder.encode_thumbnail(image, self.thumbnail_height)))
+                for file_name, data in files:
+                    with open(session.path(file_name), "wb") as file:
+                        file.write(data)
+        except Exception:
+            traceback.print_exc()
+            self.archive_stage.put(session, SESSION_FAILED, None)
+        else:
+            for file_name, _ in files:
+                self.archive_stage.put(session, file_name, session.path(file_name))
+
+    def archive_image(self, session, name, path):
+        # a failed session may still send images that were already on their way
+        if session.id not in self.started:
+            archive = self.archives.pop(session.id, None)
+            if archive is not None:
+                archive.abort()
+            return
+        try:
+            archive = self.archives.get(session.id)
+            if archive is None:
+                archive = SessionArchive(self.archive_path(session))
+                self.archives[session.id] = archive
+            if name == SESSION_DONE:
+                with session.trace.span("archive"):
+                    self.archives.pop(session.id).close()
+                    if self.store is not None:
+                        self.store.add(session.id, archive.path)
+                self.qr_stage.put(session)
+            elif name == SESSION_FAILED:
+                self.archives.pop(session.id).abort()
+                print("Sitzung {} abgebrochen".format(session.id))
+                self.drop(session)
+            else:
+                with session.trace.span("archive"):
+                    archive.add_file(path, name)
+        except Exception:
+            archive = self.archives.pop(session.id, None)
+            if archive is not None:
+                archive.abort()
+            self.fail(session)
+
+    def archive_path(self, session):
+        if self.store is not None:
+            return self.store.path(session.id)
+        return os.path.join(self.archive_dir, session.archive_name)
+
+    def download_path(self, session):
+        # relative to the archive directory, as the web server serves it
+        if self.store is not None:
+            return self.store.relative_path(session.id)
+        return session.archive_name
+
+    def serve_session(self, session):
+        try:
+            # only the modules, the GUI scales them itself
+            with session.trace.span("qr"):
+                qr_code = qrcode.QRCode()
+                qr_code.add_data(self.download_url.format(self.download_path(session)))
+                qr_code.make(fit=True)
+                session.qr_matrix = np.array(qr_code.get_matrix(), dtype=bool)
+        except Exception:
+            self.fail(session)
+            return
+        self.started.pop(session.id)
+        seconds = session.trace.finish("served")
+        print("Sitzung {} nach {:.2f}s fertig ({})".format(session.id, seconds, session.trace.stages()))
+        session.served = True
+        # released afterwards, so a free slot means the session is completely handed over
+        try:
+            self.on_finished(session)
+        except Exception:
+            traceback.print_exc()
+            session.cleanup()
+        finally:
+            self.release()
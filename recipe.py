@@ -0,0 +1,50 @@
+import random
+import threading
+from contextlib import contextmanager
+
+# the variant the current thread renders: its random numbers, the frame size it was
+# planned for and how much smaller the image actually rendered is
+local = threading.local()
+
+
+class Recipe:
+    # a variant as its filter chain and the seed of every random choice in it,
+    # replaying it at another size gives the same picture
+    def __init__(self, chain, seed):
+        self.chain = chain
+        self.seed = seed
+
+    def __repr__(self):
+        return "Recipe({}, {})".format(self.chain, self.seed)
+
+
+def new_seed():
+    return random.getrandbits(32)
+
+
+def rng():
+    generator = getattr(local, "rng", None)
+    if generator is None:
+        generator = local.rng = random.Random()
+    return generator
+
+
+def full_shape(shape):
+    # pixel sized parameters and face positions refer to this frame size
+    return getattr(local, "full_shape", None) or tuple(shape[:2])
+
+
+def scale():
+    return getattr(local, "scale", 1)
+
+
+@contextmanager
+def replaying(seed, shape, full=None):
+    previous = (getattr(local, "rng", None), getattr(local, "full_shape", None), scale())
+    local.rng = random.Random(seed)
+    local.full_shape = tuple((full or shape)[:2])
+    local.scale = shape[0] / local.full_shape[0]
+    try:
+        yield
+    finally:
+        local.rng, local.full_shape, local.scale = previous
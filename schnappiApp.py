@@ -0,0 +1,903 @@
+from time import monotonic, monotonic_ns, sleep
+# startup times are reported relative to this
+STARTED = monotonic()
+
+from collections import deque
+from enum import Enum, auto
+import os
+import sys
+import threading
+import traceback
+
+import numpy as np
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject, QSize, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QFont, QImage, QPixmap
+from PyQt5.QtWidgets import (QApplication, QHBoxLayout, QLabel, QMainWindow, QStackedWidget,
+                             QVBoxLayout, QWidget)
+
+# the filter modules pull in skimage, scipy and PIL, they are imported by the
+# warm-up thread once the window and the camera feed are up, picamera2 and
+# gpiozero only by the hardware backends, so the booth also runs simulated
+from session import SESSION_ROOT, Session, remove_stale_sessions
+import tracing
+
+
+def reportStartup(event):
+    print("{} nach {:.2f}s".format(event, monotonic() - STARTED))
+
+
+class App:
+
+    # "array" hands the still frame to the filters in memory, "file" goes through a JPEG in the session directory
+    CAPTURE_MODE = os.environ.get("SCHNAPPI_CAPTURE_MODE", "array")
+    # "switch" changes the sensor to the still mode for every photo, "stream" keeps it running
+    # at full size and takes the photo from the live stream, without the live effect
+    STILL_SOURCE = os.environ.get("SCHNAPPI_STILL_SOURCE", "switch")
+    # with "stream", keep this many of the latest full frames during the countdown and take
+    # the one closest to its end, 0 takes the first frame after it
+    RING_BUFFER = int(os.environ.get("SCHNAPPI_RING_BUFFER", "0"))
+    # seconds to wait for the frame after the end of the countdown
+    RING_TIMEOUT = 0.2
+    # put the unfiltered photo into the download archive as well
+    ARCHIVE_ORIGINAL = False
+    ARCHIVE_DIR = os.environ.get("SCHNAPPI_ARCHIVE_DIR", "/var/www/html/img/")
+    DOWNLOAD_URL = "http://10.42.0.1/img/{}"
+    # index of the archives, outside the directory the web server serves
+    ARCHIVE_INDEX = os.environ.get("SCHNAPPI_ARCHIVE_INDEX", os.path.expanduser("~/.local/state/schnappi/archive.sqlite"))
+    # archives are deleted after this many hours, and the oldest ones, downloaded first,
+    # while all of them take more than ARCHIVE_MAX_MB or the disk has less than ARCHIVE_MIN_FREE_MB left
+    ARCHIVE_MAX_AGE_HOURS = float(os.environ.get("SCHNAPPI_ARCHIVE_MAX_AGE_HOURS", "72"))
+    ARCHIVE_MAX_MB = int(os.environ.get("SCHNAPPI_ARCHIVE_MAX_MB", "4096"))
+    # below this the booth takes no more photos, until twice of it the deleting starts early
+    ARCHIVE_MIN_FREE_MB = int(os.environ.get("SCHNAPPI_ARCHIVE_MIN_FREE_MB", "512"))
+    # seconds between two rounds of deleting
+    ARCHIVE_EVICTION_INTERVAL = 300
+    # the download log written by Apache, downloaded archives are deleted first
+    DOWNLOAD_LOG = os.environ.get("SCHNAPPI_DOWNLOAD_LOG", "/var/log/apache2/schnappi-downloads.log")
+    # sessions that may be captured or rendering at the same time
+    SESSION_QUEUE_SIZE = 2
+    VARIANTS = 4
+    # the variants are rendered this many pixels high first and shown while the
+    # full size images are still on their way to the archive
+    PREVIEW_HEIGHT = 360
+    # JPEG settings of the archived images, quality 75 and 4:2:0 are what skimage used to write
+    JPEG_QUALITY = int(os.environ.get("SCHNAPPI_JPEG_QUALITY", "75"))
+    JPEG_SUBSAMPLING = os.environ.get("SCHNAPPI_JPEG_SUBSAMPLING", "4:2:0")
+    JPEG_PROGRESSIVE = os.environ.get("SCHNAPPI_JPEG_PROGRESSIVE", "0") == "1"
+    JPEG_OPTIMIZE = os.environ.get("SCHNAPPI_JPEG_OPTIMIZE", "0") == "1"
+    # threads encoding the variants while the rest of the session still renders
+    ENCODE_WORKERS = 2
+    # every variant also goes into the archive this many pixels high, off unless set,
+    # visitors only want the full size images
+    THUMBNAIL_HEIGHT = int(os.environ.get("SCHNAPPI_THUMBNAIL_HEIGHT", "0")) or None
+    # pixels per QR code module, the same size qrcode.make used to produce
+    QR_BOX_SIZE = 10
+    # (rows, cols) of the still frame, the distortion maps are prepared for this size
+    FRAME_SHAPE = (1080, 1920)
+    # "process" renders the variants in a pre-warmed process pool, "thread" in a thread pool
+    FILTER_BACKEND = os.environ.get("SCHNAPPI_FILTER_BACKEND", "process")
+    # seconds a single variant may take, the slowest one decides how long people wait
+    VARIANT_BUDGET = float(os.environ.get("SCHNAPPI_VARIANT_BUDGET", "3"))
+    # show one of the cheap filters on the camera preview during the countdown
+    LIVE_EFFECT = os.environ.get("SCHNAPPI_LIVE_EFFECT", "1") == "1"
+    # seconds per preview frame, slower effects skip frames instead of slowing down the feed
+    LIVE_FRAME_BUDGET = 1 / 30
+    # follow the faces on the preview during the countdown instead of searching the still
+    FACE_TRACKING = os.environ.get("SCHNAPPI_FACE_TRACKING", "1") == "1"
+    # face detections per second on the preview
+    TRACKING_RATE = 3
+    # (width, height) of the grayscale stream the faces are tracked on
+    TRACKING_SIZE = (640, 360)
+    # stage and filter timings in Prometheus text format on http://<host>:<port>/metrics, 0 to turn off
+    METRICS_PORT = int(os.environ.get("SCHNAPPI_METRICS_PORT", "9180"))
+    # only reachable on the booth itself, the visitor WLAN is open
+    METRICS_HOST = os.environ.get("SCHNAPPI_METRICS_HOST", "127.0.0.1")
+    # the same text is written to this file every few seconds if set
+    METRICS_FILE = os.environ.get("SCHNAPPI_METRICS_FILE")
+    # "pi" for the camera module, "simulated" serves recorded frames for load tests without hardware
+    CAMERA = os.environ.get("SCHNAPPI_CAMERA", "pi")
+    # directory of recorded frames for the simulated camera, sample photos if unset
+    SIMULATED_FRAMES = os.environ.get("SCHNAPPI_SIMULATED_FRAMES")
+    # seconds switch_mode_and_capture takes on the Pi, the preview stands still meanwhile
+    SIMULATED_CAPTURE_DELAY = 0.5
+    SIMULATED_FRAME_INTERVAL = 1 / 30
+    # "gpio" for the coin slot and button, "script" replays visitors and quits at the end
+    CONTROLS = os.environ.get("SCHNAPPI_CONTROLS", "gpio")
+    # file of "<seconds> coin|button|end" lines, otherwise a busy evening is generated
+    VISITOR_SCRIPT = os.environ.get("SCHNAPPI_VISITOR_SCRIPT")
+    SCRIPT_MINUTES = float(os.environ.get("SCHNAPPI_SCRIPT_MINUTES", "60"))
+    VISITORS_PER_MINUTE = float(os.environ.get("SCHNAPPI_VISITORS_PER_MINUTE", "2"))
+    # seconds between memory and disk samples, printed during scripted runs
+    RESOURCE_INTERVAL = 30
+
+    def runGUI(self):
+        app = QApplication(sys.argv)
+        window = SchnappiWindow(self.camera, self.createControls())
+        window.show()
+        self.camera.startFeed()
+        # runs once the event loop has drawn the window
+        QTimer.singleShot(0, lambda: reportStartup("Kamera-Vorschau"))
+        app.exec_()
+
+    def __init__(self) -> None:
+
+        remove_stale_sessions()
+        if App.METRICS_PORT:
+            tracing.serve(App.METRICS_PORT, App.METRICS_HOST)
+        if App.METRICS_FILE:
+            tracing.write_periodically(App.METRICS_FILE)
+        # walks the archive directory, so only for scripted soak runs, the archive store
+        # keeps the archive gauges of the booth itself
+        if App.CONTROLS == "script":
+            tracing.watch_resources([path for path in (App.ARCHIVE_DIR, SESSION_ROOT) if path], App.RESOURCE_INTERVAL)
+        if App.CAMERA == "simulated":
+            self.camera = SimulatedCamera(App.CAPTURE_MODE, App.SIMULATED_FRAMES)
+        else:
+            self.camera = SchnappiCamera(App.CAPTURE_MODE, App.STILL_SOURCE, App.RING_BUFFER)
+
+        self.runGUI()
+
+    def createControls(self):
+        if App.CONTROLS != "script":
+            return SchnappiCoinButtonWorker()
+        import visitorScript
+        if App.VISITOR_SCRIPT:
+            events = visitorScript.load(App.VISITOR_SCRIPT)
+        else:
+            events = visitorScript.busy_evening(App.SCRIPT_MINUTES, App.VISITORS_PER_MINUTE)
+        return ScriptedCoinButtonWorker(events)
+
+
+class SchnappiWarmUpWorker(QThread):
+    # carries the filter engine, the live effect and the face tracker, None if turned off,
+    # and the archive store
+    ready = pyqtSignal(object, object, object, object)
+
+    def run(self):
+        import faceFilters
+        import pipeline
+        import warpMaps
+        from filterEngine import WARM_UP_SHAPE, create_filter_engine
+        # only slow on the very first boot, afterwards the maps come from the disk cache
+        threading.Thread(target=warpMaps.prepare, args=(App.FRAME_SHAPE,), daemon=True).start()
+        faceFilters.detect_faces(np.zeros(WARM_UP_SHAPE, dtype=np.uint8))
+        # runs every filter once, in the workers or in this process
+        filterEngine = create_filter_engine(App.FILTER_BACKEND, budget=App.VARIANT_BUDGET)
+        liveEffect = None
+        if App.LIVE_EFFECT:
+            from liveEffect import LiveEffect
+            liveEffect = LiveEffect(App.FRAME_SHAPE, App.LIVE_FRAME_BUDGET)
+        faceTracker = None
+        if App.FACE_TRACKING:
+            from faceTracker import FaceTracker
+            faceTracker = FaceTracker(App.FRAME_SHAPE, App.TRACKING_RATE)
+        # indexes archives it does not know yet, the first start after an update takes a moment
+        from archiveStore import ArchiveStore
+        archiveStore = ArchiveStore(
+            App.ARCHIVE_DIR, App.ARCHIVE_INDEX, App.ARCHIVE_MAX_AGE_HOURS * 3600,
+            App.ARCHIVE_MAX_MB * 2**20, App.ARCHIVE_MIN_FREE_MB * 2**20
+        )
+        archiveStore.start(App.ARCHIVE_EVICTION_INTERVAL)
+        archiveStore.follow_downloads(App.DOWNLOAD_LOG)
+        reportStartup("Bereit")
+        self.ready.emit(filterEngine, liveEffect, faceTracker, archiveStore)
+
+
+def scaledQImage(array, size, transformation=QtCore.Qt.SmoothTransformation):
+    # the QImage is only a view on the array, the scaled result owns its pixels
+    array = np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    imageFormat = QImage.Format_RGB888 if array.ndim == 3 else QImage.Format_Grayscale8
+    view = QImage(array.data, width, height, array.strides[0], imageFormat)
+    scaled = view.scaled(size, QtCore.Qt.KeepAspectRatio, transformation)
+    # scaling to the same size only shares the view
+    return view.copy() if scaled.size() == view.size() else scaled
+
+
+class SchnappiCaptureWorker(QThread):
+    # the session and its QImages, converted and scaled on the pipeline threads
+    previewReady = pyqtSignal(object, object)
+    imagesServed = pyqtSignal(object, object)
+    # the session that was given up, the visitor gets the credit back
+    sessionFailed = pyqtSignal(object)
+
+    def __init__(self, camera, filterEngine, archiveStore, doCapture, *, parent=None):
+        super().__init__(parent)
+        # already imported by the warm-up
+        from jpegEncoder import JpegEncoder
+        from pipeline import SessionPipeline
+        self.camera = camera
+        self.archiveStore = archiveStore
+        # updated by the preview widget once it knows its label size
+        self.previewSize = QSize(App.PREVIEW_HEIGHT * 16 // 9, App.PREVIEW_HEIGHT)
+        self.pipeline = SessionPipeline(
+            filterEngine, App.VARIANTS, App.ARCHIVE_DIR, App.DOWNLOAD_URL, App.SESSION_QUEUE_SIZE,
+            self.serveQrCode, App.ARCHIVE_ORIGINAL, App.PREVIEW_HEIGHT, self.servePreviews,
+            JpegEncoder(App.JPEG_QUALITY, App.JPEG_SUBSAMPLING, App.JPEG_PROGRESSIVE, App.JPEG_OPTIMIZE),
+            App.ENCODE_WORKERS, App.THUMBNAIL_HEIGHT, archiveStore, self.sessionFailed.emit
+        )
+        doCapture.connect(self.captureImage)
+        self.camera.captureDone.connect(self.pipeline.submit)
+        self.camera.captureFailed.connect(self.pipeline.abandon)
+
+    def reserveSession(self):
+        return self.pipeline.begin()
+
+    def storageFull(self):
+        from archiveStore import FULL
+        return self.archiveStore.status() == FULL
+
+    def setPreviewSize(self, size):
+        self.previewSize = size
+
+    def servePreviews(self, session):
+        size = self.previewSize
+        self.previewReady.emit(session, [scaledQImage(preview, size) for preview in session.previews])
+
+    def serveQrCode(self, session):
+        # dark modules on white, scaled without smoothing to keep the edges sharp
+        pixels = np.where(session.qr_matrix, 0, 255).astype(np.uint8)
+        size = QSize(pixels.shape[1], pixels.shape[0]) * App.QR_BOX_SIZE
+        self.imagesServed.emit(session, scaledQImage(pixels, size, QtCore.Qt.FastTransformation))
+
+    def captureImage(self):
+        self.camera.finishCapture(Session(), self.camera.captureImage)
+
+    def run(self):
+        self.exec_()
+
+
+class SchnappiCoinButtonWorker(QThread):
+    coinInserted = pyqtSignal()
+    buttonPress = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        from gpiozero import LED, Button
+        self.counter = Button(17)
+        self.button = Button(22)
+        self.led = LED(23)
+
+    def setLed(self, on):
+        if on:
+            self.led.on()
+        else:
+            self.led.off()
+
+    def run(self):
+        self.counter.when_pressed = lambda: self.coinInserted.emit()
+        while True:
+            self.button.wait_for_press()
+            self.buttonPress.emit()
+            sleep(1)
+
+
+class ScriptedCoinButtonWorker(QThread):
+    # replays (seconds, event) pairs instead of the GPIO pins, the thread ends with the script
+    coinInserted = pyqtSignal()
+    buttonPress = pyqtSignal()
+
+    def __init__(self, events, parent=None):
+        super().__init__(parent)
+        self.events = events
+
+    def setLed(self, on):
+        pass
+
+    def run(self):
+        start = monotonic()
+        for seconds, event in self.events:
+            sleep(max(0, start + seconds - monotonic()))
+            if event == "coin":
+                self.coinInserted.emit()
+            elif event == "button":
+                self.buttonPress.emit()
+            else:
+                return
+
+
+class SchnappiWindow(QMainWindow):
+    doCapture = pyqtSignal()
+
+    class State(Enum):
+        Capture = auto()
+        Countdown = auto()
+        ResultPreview = auto()
+        QrCode = auto()
+
+    def __init__(self, camera, controls):
+        super().__init__()
+        self.camera = camera
+
+        self.state = self.State.Capture
+        self.session = None
+        self.credits = 0
+        # sessions with previews waiting for the screen, as (session, preview images)
+        self.readySessions = deque()
+        # QR codes of served sessions that are waiting or on the screen
+        self.qrCodes = {}
+
+        self.buttonThread = controls
+        self.buttonThread.coinInserted.connect(self.handleCoin)
+        self.buttonThread.buttonPress.connect(self.handleButtonPress)
+        # only a visitor script ever ends
+        self.buttonThread.finished.connect(QApplication.quit)
+        self.buttonThread.start()
+
+        # created once the warm-up is done
+        self.captureThread = None
+        self.previewSize = None
+        self.firstResult = True
+        self.warmUpThread = SchnappiWarmUpWorker()
+        self.warmUpThread.ready.connect(self.warmedUp)
+        self.warmUpThread.start()
+
+        self.stackedWidget = QStackedWidget()
+
+        self.schnappiWidget = SchnappiWidget(self, camera)
+        self.schnappiPreviewWidget = SchnappiPreviewWidget(self)
+        self.schnappiPreviewWidget.imageSizeChanged.connect(self.previewSizeChanged)
+        self.schnappiQRWidget = SchnappiQRWidget(self)
+
+        self.stackedWidget.addWidget(self.schnappiWidget)
+        self.stackedWidget.addWidget(self.schnappiPreviewWidget)
+        self.stackedWidget.addWidget(self.schnappiQRWidget)
+
+        self.setWindowTitle("Schnappi - Die Schnappschusskiste")
+        self.showFullScreen()
+        self.setCentralWidget(self.stackedWidget)
+        self.stackedWidget.setCurrentWidget(self.schnappiWidget)
+        self.schnappiWidget.showWarmingUp()
+
+    def warmedUp(self, filterEngine, liveEffect, faceTracker, archiveStore):
+        self.camera.setFrameProcessing(liveEffect, faceTracker)
+        self.captureThread = SchnappiCaptureWorker(self.camera, filterEngine, archiveStore, self.doCapture)
+        self.captureThread.previewReady.connect(self.previewReady)
+        self.captureThread.imagesServed.connect(self.sessionFinished)
+        self.captureThread.sessionFailed.connect(self.sessionFailed)
+        if self.previewSize is not None:
+            self.captureThread.setPreviewSize(self.previewSize)
+        self.captureThread.start()
+        if self.state == self.State.Capture:
+            self.schnappiWidget.showHint(self.credits)
+
+    def previewSizeChanged(self, size):
+        self.previewSize = size
+        if self.captureThread is not None:
+            self.captureThread.setPreviewSize(size)
+
+    def handleCoin(self):
+        self.credits += 1
+        self.buttonThread.setLed(True)
+        if self.state == self.State.Capture and self.captureThread is not None:
+            self.schnappiWidget.showHint(self.credits)
+
+    def handleButtonPress(self):
+        if self.state == self.State.Capture:
+            self.startCountdown()
+        elif self.state == self.State.ResultPreview:
+            self.showQRCode()
+        elif self.state == self.State.QrCode:
+            self.showCamera()
+
+    def startCountdown(self):
+        if self.credits == 0 or self.captureThread is None:
+            return
+        # keeps the credit, old archives are deleted in the background meanwhile
+        if self.captureThread.storageFull():
+            self.schnappiWidget.showStorageFull()
+            return
+        # the pipeline is full, the next photo has to wait for a session to finish
+        if not self.captureThread.reserveSession():
+            self.schnappiWidget.showBusy()
+            return
+        self.credits -= 1
+        self.buttonThread.setLed(self.credits > 0)
+        self.state = self.State.Countdown
+        self.camera.startFrameProcessing()
+        self.schnappiWidget.doCountdown(3)
+        QTimer.singleShot(3000, self.capture)
+
+    def capture(self):
+        self.doCapture.emit()
+        # the photo is rendered in the background, the booth is free for the next one
+        self.state = self.State.Capture
+        self.schnappiWidget.showHint(self.credits)
+        self.showNextResult()
+
+    def previewReady(self, session, images):
+        if self.firstResult:
+            reportStartup("Erstes Ergebnis")
+            self.firstResult = False
+        self.readySessions.append((session, images))
+        if self.state == self.State.Capture:
+            self.showNextResult()
+
+    def sessionFinished(self, session, qrCode):
+        if session is self.session:
+            self.qrCodes[session.id] = qrCode
+            if self.state == self.State.QrCode:
+                self.schnappiQRWidget.loadQrCode(qrCode)
+        elif any(waiting is session for waiting, _ in self.readySessions):
+            self.qrCodes[session.id] = qrCode
+        else:
+            # already left the screen while the archive was written
+            session.cleanup()
+
+    def sessionFailed(self, session):
+        # the photo was paid for, so the credit comes back
+        print("Sitzung {} fehlgeschlagen, Guthaben zurückgegeben".format(session.id))
+        self.credits += 1
+        self.buttonThread.setLed(True)
+        self.readySessions = deque((waiting, images) for waiting, images in self.readySessions if waiting is not session)
+        if session is self.session:
+            # None marks the failed session for showQRCode
+            self.qrCodes[session.id] = None
+            if self.state == self.State.QrCode:
+                self.schnappiQRWidget.showFailed()
+        elif self.state == self.State.Capture:
+            self.schnappiWidget.showHint(self.credits)
+
+    def showNextResult(self):
+        if self.readySessions:
+            self.showPreview(*self.readySessions.popleft())
+
+    def showCamera(self):
+        self.state = self.State.Capture
+        if self.session is not None:
+            # otherwise sessionFinished cleans up once the archive is written
+            if self.session.served:
+                self.session.cleanup()
+            self.qrCodes.pop(self.session.id, None)
+            self.session = None
+        self.stackedWidget.setCurrentWidget(self.schnappiWidget)
+        self.schnappiWidget.showHint(self.credits)
+        self.showNextResult()
+
+    def showPreview(self, session, images):
+        self.state = self.State.ResultPreview
+        self.session = session
+        self.schnappiPreviewWidget.loadImages(images)
+        self.stackedWidget.setCurrentWidget(self.schnappiPreviewWidget)
+
+    def showQRCode(self):
+        self.state = self.State.QrCode
+        if self.session.id not in self.qrCodes:
+            self.schnappiQRWidget.showPending()
+        elif self.qrCodes[self.session.id] is None:
+            self.schnappiQRWidget.showFailed()
+        else:
+            self.schnappiQRWidget.loadQrCode(self.qrCodes[self.session.id])
+        self.stackedWidget.setCurrentWidget(self.schnappiQRWidget)
+
+class SchnappiWidget(QWidget):
+
+    def __init__(self, parent, camera):
+        super(QWidget, self).__init__(parent)
+        self.layout = QVBoxLayout()
+
+        self.titleLabel = QLabel()
+        self.titleLabel.setText("Schnappi - Die Schnappschusskiste")
+        self.titleLabel.setFont(QFont("Quicksand", 30))
+        self.titleLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.titleLabel.resize(200, 30)
+        self.layout.addWidget(self.titleLabel)
+
+        self.layout.addWidget(camera.createPreviewWidget())
+
+        self.descriptionLabel = QLabel()
+        self.showHint()
+        self.descriptionLabel.setFont(QFont("Quicksand", 30))
+        self.descriptionLabel.setStyleSheet("color: orange;")
+        self.descriptionLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.descriptionLabel.resize(200, 30)
+        self.layout.addWidget(self.descriptionLabel)
+
+        self.layout.setStretch(1,3)
+        self.setLayout(self.layout)
+
+    def showHint(self, credits=0):
+        if credits > 0:
+            self.descriptionLabel.setText("Drücke den Knopf und gehe einen Schritt zurück.")
+        else:
+            self.descriptionLabel.setText("Wirf 1€ ein, drücke den Knopf und gehe einen Schritt zurück.")
+
+    def showWarmingUp(self):
+        self.descriptionLabel.setText("Einen Moment, die Schnappschusskiste startet noch.")
+
+    def showBusy(self):
+        self.descriptionLabel.setText("Einen Moment, die letzten Bilder werden noch berechnet.")
+
+    def showStorageFull(self):
+        self.descriptionLabel.setText("Der Speicher ist voll, bitte versuche es gleich noch einmal.")
+
+    def doCountdown(self, n):
+        self.descriptionLabel.setText("{}...".format(n))
+        if n > 1:
+            QTimer.singleShot(1000, lambda: self.doCountdown(n - 1))
+
+
+class SchnappiQRWidget(QWidget):
+
+    def __init__(self, parent):
+        super(QWidget, self).__init__(parent)
+        self.layout = QVBoxLayout()
+
+        self.titleLabel = QLabel()
+        self.titleLabel.setText("QRCODE")
+        self.titleLabel.setFont(QFont("Quicksand", 30))
+        self.titleLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.titleLabel.resize(200, 30)
+        self.layout.addWidget(self.titleLabel)
+
+        self.row = QHBoxLayout()
+        self.layout.addLayout(self.row)
+        self.col1 = QVBoxLayout()
+        self.col2 = QVBoxLayout()
+        self.row.addLayout(self.col1)
+        self.row.addLayout(self.col2)
+
+        self.wifiCode = QLabel()
+        pixmap = QPixmap("/home/schnappi/Desktop/wlan_verbinden.png")
+        self.wifiCode.setPixmap(pixmap)
+        self.wifiCode.setAlignment(QtCore.Qt.AlignCenter)
+        self.col1.addSpacing(200)
+        self.col1.addWidget(self.wifiCode)
+        self.wifiDescription = QLabel()
+        self.wifiDescription.setText("1. Mit unserem WLAN verbinden.")
+        self.wifiDescription.setFont(QFont("Quicksand", 30))
+        self.wifiDescription.setStyleSheet("color: orange;")
+        self.wifiDescription.setAlignment(QtCore.Qt.AlignCenter)
+        self.col1.addWidget(self.wifiDescription)
+        self.col1.addSpacing(200)
+
+        self.downloadLink = QLabel()
+        self.downloadLink.setAlignment(QtCore.Qt.AlignCenter)
+        self.col2.addSpacing(200)
+        self.col2.addWidget(self.downloadLink)
+        self.downloadDescription = QLabel()
+        self.downloadDescription.setText("2. Bilder herunterladen.")
+        self.downloadDescription.setFont(QFont("Quicksand", 30))
+        self.downloadDescription.setStyleSheet("color: orange;")
+        self.downloadDescription.setAlignment(QtCore.Qt.AlignCenter)
+        self.col2.addWidget(self.downloadDescription)
+        self.col2.addSpacing(200)
+
+        self.descriptionLabel = QLabel()
+        self.descriptionLabel.setText("Drücke den Knopf, um wieder zum Anfang zu kommen.")
+        self.descriptionLabel.setFont(QFont("Quicksand", 30))
+        self.descriptionLabel.setStyleSheet("color: orange;")
+        self.descriptionLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.descriptionLabel.resize(200, 30)
+        self.layout.addWidget(self.descriptionLabel)
+
+        self.layout.setStretch(1,2)
+        self.setLayout(self.layout)
+
+    def loadQrCode(self, qrCode):
+        self.downloadLink.setPixmap(QPixmap.fromImage(qrCode))
+
+    def showPending(self):
+        self.downloadLink.setFont(QFont("Quicksand", 30))
+        self.downloadLink.setText("Der Download wird noch vorbereitet...")
+
+    def showFailed(self):
+        self.downloadLink.setFont(QFont("Quicksand", 30))
+        self.downloadLink.setText("Die Bilder konnten leider nicht gespeichert werden.\nDein Euro ist wieder gutgeschrieben.")
+
+
+class SchnappiPreviewWidget(QWidget):
+    imageSizeChanged = pyqtSignal(object)
+
+    def __init__(self, parent):
+        super().__init__(parent)
+
+        self.layout = QVBoxLayout()
+
+        self.titleLabel = QLabel()
+        self.titleLabel.setText("VORSCHAU")
+        self.titleLabel.setFont(QFont("Quicksand", 30))
+        self.titleLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.titleLabel.resize(200, 30)
+        self.layout.addWidget(self.titleLabel)
+
+        self.imageGrid = QVBoxLayout()
+        self.row1 = QHBoxLayout()
+        self.row2 = QHBoxLayout()
+        self.imageGrid.addLayout(self.row1)
+        self.imageGrid.addLayout(self.row2)
+        self.layout.addLayout(self.imageGrid)
+
+        self.images = [QLabel(), QLabel(), QLabel(), QLabel()]
+        self.row1.addWidget(self.images[0])
+        self.row1.addWidget(self.images[1])
+        self.row2.addWidget(self.images[2])
+        self.row2.addWidget(self.images[3])
+        for image in self.images:
+            image.setAlignment(QtCore.Qt.AlignCenter)
+
+        self.descriptionLabel = QLabel()
+        self.descriptionLabel.setText("Drücke den Knopf, um zum Download der Bilder zu kommen.")
+        self.descriptionLabel.setFont(QFont("Quicksand", 30))
+        self.descriptionLabel.setStyleSheet("color: orange;")
+        self.descriptionLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.descriptionLabel.resize(200, 30)
+        self.layout.addWidget(self.descriptionLabel)
+
+        self.layout.setStretch(1, 2)
+        self.setLayout(self.layout)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # the layout has already resized the labels, later previews are scaled to fit them
+        self.imageSizeChanged.emit(self.images[0].size())
+
+    def loadImages(self, images):
+        # already scaled on the pipeline threads
+        for label, image in zip(self.images, images):
+            label.setPixmap(QPixmap.fromImage(image))
+
+
+class CameraBase(QObject):
+    # what the window and the capture worker need from a camera: the preview widget,
+    # the live effect and face tracking during the countdown, and the still capture
+    # carries the session and its still frame, or None if it was written to session.capture_path
+    captureDone = pyqtSignal(object, object)
+    # carries the session of a capture that raised
+    captureFailed = pyqtSignal(object)
+
+    def __init__(self, captureMode):
+        super().__init__()
+        self.captureMode = captureMode
+        self.liveEffect = None
+        self.faceTracker = None
+
+    def setFrameProcessing(self, liveEffect, faceTracker):
+        self.liveEffect = liveEffect
+        self.faceTracker = faceTracker
+
+    def startFrameProcessing(self):
+        if self.faceTracker is not None:
+            self.faceTracker.start()
+        if self.liveEffect is not None:
+            print("Live-Effekt: {}".format(self.liveEffect.start()))
+
+    def stopFrameProcessing(self, session):
+        if self.faceTracker is not None:
+            session.faces = self.faceTracker.stop()
+        if self.liveEffect is not None:
+            self.liveEffect.stop()
+
+    def wantsTrackingFrame(self):
+        return self.faceTracker is not None and self.faceTracker.wants_frame()
+
+    def liveEffectActive(self):
+        return self.liveEffect is not None and self.liveEffect.effect is not None
+
+    def applyLiveEffect(self, frame):
+        if self.faceTracker is not None:
+            self.liveEffect.faces = self.faceTracker.faces() or []
+        self.liveEffect.process(frame)
+
+    def finishCapture(self, session, capture, *args):
+        # runs capture(session, *args) on whatever thread the capture ends on, a capture that
+        # raises still hands its session back, so the slot it took is returned
+        try:
+            capture(session, *args)
+        except Exception:
+            traceback.print_exc()
+            self.captureFailed.emit(session)
+
+    def captureFinished(self, session, image):
+        # the session was created right before the capture started
+        seconds = monotonic() - session.trace.start
+        session.trace.add("capture", seconds)
+        print("Bild nach {:.0f} ms aufgenommen{}".format(seconds * 1000, "" if image is not None else " und gespeichert"))
+        self.captureDone.emit(session, image)
+
+
+class SchnappiCamera(CameraBase):
+
+    def __init__(self, captureMode, stillSource="switch", ringSize=0):
+        super().__init__(captureMode)
+        from libcamera import controls, Transform
+        from picamera2 import MappedArray, Picamera2
+        self.mappedArray = MappedArray
+        self.transform = Transform(hflip=True)
+        self.stillSource = stillSource
+        self.picam2 = Picamera2()
+        self.qpicamera2 = None
+        self.ring = None
+
+        if stillSource == "stream":
+            # the sensor keeps running at still size, main holds the full frame and the
+            # preview shows lores, there is no mode switch and the preview never stops
+            # BGR888 arrays are laid out as [R, G, B]
+            self.loresSize = (1280, 720)
+            self.picam2.configure(self.picam2.create_preview_configuration(main={"size": (1920, 1080), "format": "BGR888"}, raw={"size": (1920, 1080)}, lores={"size": self.loresSize}, display="lores", buffer_count=4, transform=self.transform))
+            if ringSize:
+                from frameRing import FrameRing
+                self.ring = FrameRing(ringSize, App.FRAME_SHAPE + (3,))
+        else:
+            # the live effect draws on the displayed stream, lores frames are YUV420 on the Pi,
+            # so the RGB main stream is shown, XBGR8888 arrays are laid out as [R, G, B, 255]
+            # the faces are tracked on the luma plane of the small lores stream
+            self.loresSize = App.TRACKING_SIZE
+            self.picam2.configure(self.picam2.create_preview_configuration(main={"size": (1280, 720), "format": "XBGR8888"}, raw={"size": (1280, 720)}, lores={"size": self.loresSize}, display="main", transform=self.transform))
+            # built once, every capture switches to it and back
+            self.stillConfig = self.picam2.create_still_configuration(main={"size": (1920, 1080), "format": "BGR888"}, raw={"size": (1920, 1080)}, lores={"size": (1920, 1080)}, display="lores", transform=self.transform)
+        self.picam2.set_controls({"AfMode": controls.AfModeEnum.Continuous})
+        if self.ring is not None:
+            self.picam2.pre_callback = self.processFrame
+
+    def createPreviewWidget(self):
+        from picamera2.previews.qt import QGlPicamera2
+        self.qpicamera2 = QGlPicamera2(self.picam2, width=1920, height=1080, keep_ar=True)
+        return self.qpicamera2
+
+    def startFeed(self):
+        self.picam2.start()
+
+    def setFrameProcessing(self, liveEffect, faceTracker):
+        if self.stillSource == "stream" and liveEffect is not None:
+            # the preview shows the YUV lores stream, and main is the photo
+            print("Kein Live-Effekt bei Aufnahmen aus dem laufenden Bild")
+            liveEffect = None
+        super().setFrameProcessing(liveEffect, faceTracker)
+        if liveEffect is not None or faceTracker is not None:
+            self.picam2.pre_callback = self.processFrame
+
+    def startFrameProcessing(self):
+        super().startFrameProcessing()
+        if self.ring is not None:
+            self.ring.start()
+
+    def processFrame(self, request):
+        # runs on the camera thread before the frame is shown
+        if self.wantsTrackingFrame():
+            width, height = self.loresSize
+            step = width // App.TRACKING_SIZE[0]
+            with self.mappedArray(request, "lores") as mapped:
+                self.faceTracker.put(mapped.array[:height:step, :width:step].copy())
+        if self.liveEffectActive():
+            with self.mappedArray(request, "main") as mapped:
+                self.applyLiveEffect(mapped.array[..., :3])
+        if self.ring is not None and self.ring.active:
+            with self.mappedArray(request, "main") as mapped:
+                self.ring.put(request.get_metadata()["SensorTimestamp"], mapped.array)
+
+    def captureImage(self, session):
+        # the still frame must not get the effect, the faces go with the session
+        self.stopFrameProcessing(session)
+        if self.stillSource == "stream":
+            self.captureFromStream(session)
+        elif self.captureMode == "file":
+            self.picam2.switch_mode_and_capture_file(self.stillConfig, session.capture_path, signal_function=lambda job: self.finishCapture(session, self.fileCaptured, job))
+        else:
+            self.picam2.switch_mode_and_capture_array(self.stillConfig, "main", signal_function=lambda job: self.finishCapture(session, self.arrayCaptured, job))
+
+    def fileCaptured(self, session, job):
+        # raises if the capture failed
+        self.picam2.wait(job)
+        self.captureFinished(session, None)
+
+    def arrayCaptured(self, session, job):
+        self.captureFinished(session, self.picam2.wait(job))
+
+    def captureFromStream(self, session):
+        # SensorTimestamp counts in monotonic nanoseconds
+        shutter = monotonic_ns()
+        if self.ring is not None:
+            # the frame closest to the end of the countdown, before or after it
+            frame = self.ring.nearest(shutter, App.RING_TIMEOUT)
+            self.ring.stop()
+            if frame is not None:
+                self.streamCaptured(session, shutter, *frame)
+                return
+        # the first frame exposed after the shutter
+        self.picam2.capture_request(flush=shutter, signal_function=lambda job: self.finishCapture(session, self.requestCaptured, shutter, job))
+
+    def requestCaptured(self, session, shutter, job):
+        request = self.picam2.wait(job)
+        try:
+            image = request.make_array("main")
+            timestamp = request.get_metadata()["SensorTimestamp"]
+        finally:
+            request.release()
+        self.streamCaptured(session, shutter, timestamp, image)
+
+    def streamCaptured(self, session, shutter, timestamp, image):
+        tracing.observe(tracing.SHUTTER_OFFSET_SECONDS, (timestamp - shutter) / 1e9)
+        print("Belichtung {:+.0f} ms nach dem Auslösen".format((timestamp - shutter) / 1e6))
+        if self.captureMode == "file":
+            from PIL import Image
+            Image.fromarray(image).save(session.capture_path, quality=95)
+            image = None
+        self.captureFinished(session, image)
+
+
+def loadFrames(directory, shape):
+    # recorded frames cropped to the still size, or the skimage sample photos
+    from PIL import Image, ImageOps
+    if directory:
+        images = [Image.open(os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+                  if name.lower().endswith((".jpg", ".jpeg", ".png"))]
+    else:
+        import skimage as ski
+        images = [Image.fromarray(getattr(ski.data, name)()) for name in ("astronaut", "chelsea", "coffee")]
+    if not images:
+        raise ValueError("no frames in {}".format(directory))
+    size = (shape[1], shape[0])
+    return [np.asarray(ImageOps.fit(image.convert("RGB"), size, Image.BILINEAR, centering=(0.5, 0.3)))
+            for image in images]
+
+
+class SimulatedCamera(CameraBase):
+    # recorded frames instead of the camera module, with the preview stopping for as long
+    # as the mode switch and capture take on the Pi
+    # the preview frame as a QImage
+    frameReady = pyqtSignal(object)
+
+    def __init__(self, captureMode, framesDirectory=None):
+        super().__init__(captureMode)
+        from PIL import Image
+        self.stills = loadFrames(framesDirectory, App.FRAME_SHAPE)
+        self.previews = [np.asarray(Image.fromarray(still).resize((1280, 720), Image.BILINEAR)) for still in self.stills]
+        self.frameCounter = 0
+        # held by a capture, the feed waits like the real preview during the mode switch
+        self.modeLock = threading.Lock()
+
+    def createPreviewWidget(self):
+        label = QLabel()
+        label.setAlignment(QtCore.Qt.AlignCenter)
+        label.setMinimumSize(1, 1)
+        self.frameReady.connect(lambda image: label.setPixmap(
+            QPixmap.fromImage(image).scaled(label.size(), QtCore.Qt.KeepAspectRatio)))
+        return label
+
+    def startFeed(self):
+        threading.Thread(target=self.runFeed, name="simulated camera", daemon=True).start()
+
+    def currentFrame(self, frames):
+        # every recorded frame is shown for a second
+        return frames[int(self.frameCounter * App.SIMULATED_FRAME_INTERVAL) % len(frames)]
+
+    def runFeed(self):
+        while True:
+            start = monotonic()
+            with self.modeLock:
+                frame = self.currentFrame(self.previews).copy()
+                self.frameCounter += 1
+            if self.wantsTrackingFrame():
+                luma = frame[::2, ::2].astype(np.uint16) @ np.array([54, 183, 19], dtype=np.uint16)
+                self.faceTracker.put((luma >> 8).astype(np.uint8))
+            if self.liveEffectActive():
+                self.applyLiveEffect(frame)
+            try:
+                self.frameReady.emit(scaledQImage(frame, QSize(frame.shape[1], frame.shape[0])))
+            except RuntimeError:
+                # Qt already deleted the camera, the visitor script has ended
+                return
+            sleep(max(0, start + App.SIMULATED_FRAME_INTERVAL - monotonic()))
+
+    def captureImage(self, session):
+        self.stopFrameProcessing(session)
+        threading.Thread(target=self.finishCapture, args=(session, self.runCapture), daemon=True).start()
+
+    def runCapture(self, session):
+        if App.STILL_SOURCE == "stream":
+            # taken from the running stream, the next frame is there after one frame interval
+            sleep(App.SIMULATED_FRAME_INTERVAL)
+            still = self.currentFrame(self.stills).copy()
+        else:
+            with self.modeLock:
+                sleep(App.SIMULATED_CAPTURE_DELAY)
+                still = self.currentFrame(self.stills).copy()
+        if self.captureMode == "file":
+            from PIL import Image
+            Image.fromarray(still).save(session.capture_path, quality=90)
+            self.captureFinished(session, None)
+        else:
+            self.captureFinished(session, still)
+
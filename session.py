@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import uuid
+
+from tracing import Trace
+
+# tmpfs, so the working files of a session never touch the SD card
+SESSION_ROOT = "/dev/shm" if os.path.isdir("/dev/shm") else None
+SESSION_PREFIX = "schnappischuss-"
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_sessions(root=SESSION_ROOT):
+    # working directories of crashed or killed runs, they stay in RAM until the next boot,
+    # directories of runs that are still alive are left alone
+    root = root or tempfile.gettempdir()
+    removed = 0
+    for name in os.listdir(root):
+        if not name.startswith(SESSION_PREFIX):
+            continue
+        pid = name[len(SESSION_PREFIX):].split("-", 1)[0]
+        if pid.isdigit() and process_alive(int(pid)):
+            continue
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        removed += 1
+    if removed:
+        print("{} alte Sitzungsordner gelöscht".format(removed))
+    return removed
+
+
+class Session:
+    def __init__(self, root=SESSION_ROOT):
+        self.id = str(uuid.uuid4())
+        # the process id tells remove_stale_sessions whether the directory is still in use
+        self.work_dir = tempfile.mkdtemp(prefix="{}{}-{}-".format(SESSION_PREFIX, os.getpid(), self.id), dir=root)
+        self.archive_name = "{}.zip".format(self.id)
+        # spans of the capture and every pipeline stage, started with the capture
+        self.trace = Trace()
+        # faces tracked on the camera preview, in still frame coordinates, None to detect them
+        self.faces = None
+        # small renders of the variants, filled in before the full size images exist
+        self.previews = None
+        # dark modules of the download QR code, border included
+        self.qr_matrix = None
+        # the archive and QR code are ready
+        self.served = False
+
+    def path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def image_name(self, image_counter):
+        return "{}.jpg".format(image_counter)
+
+    def image_path(self, image_counter):
+        return self.path(self.image_name(image_counter))
+
+    def thumbnail_name(self, image_counter):
+        return "{}_klein.jpg".format(image_counter)
+
+    def thumbnail_path(self, image_counter):
+        return self.path(self.thumbnail_name(image_counter))
+
+    @property
+    def capture_path(self):
+        return self.path("capture.jpg")
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __repr__(self):
+        return "Session({})".format(self.id)
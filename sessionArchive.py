@@ -0,0 +1,42 @@
+import os
+import zipfile
+
+# already compressed, deflating them again only costs CPU
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class SessionArchive:
+    # members are added while the session is still rendering, the archive only
+    # appears under its final name once it is complete
+    def __init__(self, path):
+        self.path = path
+        directory, name = os.path.split(path)
+        self.temp_path = os.path.join(directory, ".{}.part".format(name))
+        self.archive = zipfile.ZipFile(
+            self.temp_path, mode='x', compression=zipfile.ZIP_DEFLATED, allowZip64=True
+        )
+
+    def compression(self, name):
+        if name.lower().endswith(STORED_EXTENSIONS):
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def add_file(self, path, name):
+        self.archive.write(path, name, compress_type=self.compression(name))
+
+    def close(self):
+        self.archive.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.archive.close()
+        os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
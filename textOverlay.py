@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+CAPTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schnappi_text.txt")
+# the font matplotlib used, the Pi ships it with fonts-dejavu-core
+FONT_NAME = "DejaVuSans.ttf"
+# font sizes are given in points like before, matplotlib drew them at 100 dpi
+POINTS_TO_PIXELS = 100 / 72
+
+captions = None
+fonts = {}
+
+
+def load_captions():
+    global captions
+    if captions is None:
+        with open(CAPTIONS_PATH, 'r', encoding='utf-8') as file:
+            captions = [line.strip() for line in file if line.strip()]
+    return captions
+
+
+def random_caption(rng):
+    return rng.choice(load_captions())
+
+
+def load_font(size):
+    size = max(1, round(size))
+    font = fonts.get(size)
+    if font is None:
+        try:
+            font = ImageFont.truetype(FONT_NAME, size)
+        except OSError:
+            font = ImageFont.load_default(size)
+        fonts[size] = font
+    return font
+
+
+def caption_mask(text, size, rotation):
+    # coverage of the rotated text in a tile just big enough to hold it
+    font = load_font(size)
+    left, top, right, bottom = font.getbbox(text)
+    tile = Image.new('L', (right - left + 2, bottom - top + 2), 0)
+    ImageDraw.Draw(tile).text((1 - left, 1 - top), text, fill=255, font=font)
+    return np.asarray(tile.rotate(rotation, resample=Image.BICUBIC, expand=True))
+
+
+def draw_caption(image, text, center, size, color, rotation):
+    # blends the caption into the image in place, centred on center = (x, y)
+    mask = caption_mask(text, size, rotation)
+    height, width = image.shape[:2]
+    x0 = round(center[0]) - mask.shape[1] // 2
+    y0 = round(center[1]) - mask.shape[0] // 2
+    left, top = max(x0, 0), max(y0, 0)
+    right, bottom = min(x0 + mask.shape[1], width), min(y0 + mask.shape[0], height)
+    if left >= right or top >= bottom:
+        return image
+
+    alpha = mask[top - y0:bottom - y0, left - x0:right - x0, np.newaxis].astype(np.int32)
+    region = image[top:bottom, left:right]
+    blended = region.astype(np.int32)
+    blended += ((np.array(color, dtype=np.int32) - blended) * alpha + 127) // 255
+    region[...] = blended
+    return image
@@ -0,0 +1,97 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+# below this many rows per strip the halos cost more than the split saves
+MIN_STRIP_ROWS = 128
+CORES = os.cpu_count() or 1
+
+
+class Counter:
+    # the same interface as a multiprocessing.Value, for chains rendered in threads
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def get_lock(self):
+        return self.lock
+
+
+# chains rendering right now, shared between the workers of the process backend
+busy = Counter()
+executor = None
+executor_lock = threading.Lock()
+
+
+def share_counter(counter):
+    global busy
+    busy = counter
+
+
+@contextmanager
+def rendering():
+    with busy.get_lock():
+        busy.value += 1
+    try:
+        yield
+    finally:
+        with busy.get_lock():
+            busy.value -= 1
+
+
+def idle_cores():
+    # the calling chain has its own core, the others are free once variants finished
+    return max(1, CORES - busy.value + 1)
+
+
+def strip_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max(1, CORES - 1), thread_name_prefix="strip")
+        return executor
+
+
+class Tiling:
+    # a filter split into drawing its random parameters, the rows of context a strip
+    # needs with them (None if it cannot be split) and the work on one strip
+    def __init__(self, params, strip, halo):
+        self.params = params
+        self.strip = strip
+        self.halo = halo
+
+    def apply(self, image):
+        params = self.params()
+        return apply(image, self.strip, self.halo(**params), params)
+
+
+def apply(image, strip, halo, params):
+    rows = image.shape[0]
+    count = min(idle_cores(), rows // MIN_STRIP_ROWS)
+    if halo is None or count < 2 or halo >= rows // count:
+        return strip(image, **params)
+
+    bounds = np.linspace(0, rows, count + 1).round().astype(int)
+    # every strip gets its own copy, the strip functions may overwrite their input
+    # while the neighbours still read it as halo
+    parts = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        top, bottom = max(start - halo, 0), min(stop + halo, rows)
+        parts.append((image[top:bottom].copy(), start - top, stop - top))
+
+    def run(part):
+        padded, start, stop = part
+        return strip(padded, **params)[start:stop]
+
+    futures = [strip_executor().submit(run, part) for part in parts[1:]]
+    results = [run(parts[0])] + [future.result() for future in futures]
+    if all(result.dtype == image.dtype and result.shape[1:] == image.shape[1:] for result in results):
+        out = image
+    else:
+        out = np.empty((rows,) + results[0].shape[1:], results[0].dtype)
+    for start, stop, result in zip(bounds[:-1], bounds[1:], results):
+        out[start:stop] = result
+    return out
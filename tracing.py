@@ -0,0 +1,246 @@
+import os
+import shutil
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, perf_counter, sleep
+
+# the quantiles are taken over this many of the latest samples, about an evening of sessions
+WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+STAGE_SECONDS = "schnappi_stage_seconds"
+FILTER_SECONDS = "schnappi_filter_seconds"
+SESSION_SECONDS = "schnappi_session_seconds"
+SESSIONS = "schnappi_sessions_total"
+# exposure start of the still relative to the end of the countdown, can be negative
+SHUTTER_OFFSET_SECONDS = "schnappi_shutter_offset_seconds"
+RSS_BYTES = "schnappi_rss_bytes"
+DISK_BYTES = "schnappi_disk_bytes"
+DISK_FREE_BYTES = "schnappi_disk_free_bytes"
+ARCHIVES = "schnappi_archives"
+ARCHIVE_BYTES = "schnappi_archive_bytes"
+# lookups of intermediates shared between the renders of one capture, by hit or miss
+CAPTURE_CACHE_LOOKUPS = "schnappi_capture_cache_lookups_total"
+
+
+class Summary:
+    # rolling quantiles over the latest samples, count and sum over the whole run
+    def __init__(self):
+        self.samples = deque(maxlen=WINDOW)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        return [(q, ordered[min(int(q * len(ordered)), len(ordered) - 1)]) for q in QUANTILES] if ordered else []
+
+
+summaries = {}
+counters = {}
+gauges = {}
+lock = threading.Lock()
+
+
+def observe(name, value, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summaries[key] = Summary()
+        summary.add(value)
+
+
+def increment(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with lock:
+        gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+def quantile(name, q, **labels):
+    # None until there is a sample
+    with lock:
+        summary = summaries.get((name, tuple(sorted(labels.items()))))
+        quantiles = dict(summary.quantiles()) if summary is not None else {}
+    return quantiles.get(q)
+
+
+class Trace:
+    # the spans of one session, every span also goes into the rolling summaries
+    def __init__(self):
+        self.start = monotonic()
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, perf_counter() - start)
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+        observe(STAGE_SECONDS, seconds, stage=stage)
+
+    def add_filters(self, timings):
+        # (name, seconds) pairs of one variant, as apply_recipe collects them
+        for name, seconds in timings:
+            self.spans.append(("filter:" + name, seconds))
+            observe(FILTER_SECONDS, seconds, filter=name)
+
+    def finish(self, result):
+        seconds = monotonic() - self.start
+        if result == "served":
+            observe(SESSION_SECONDS, seconds)
+        increment(SESSIONS, result=result)
+        return seconds
+
+    def stages(self):
+        # seconds per stage, stages running in parallel threads are added up
+        totals = {}
+        for stage, seconds in self.spans:
+            if not stage.startswith("filter:"):
+                totals[stage] = totals.get(stage, 0) + seconds
+        return ", ".join("{} {:.2f}s".format(stage, seconds) for stage, seconds in totals.items())
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value) for key, value in pairs) + "}"
+
+
+def render():
+    # Prometheus text format
+    with lock:
+        summary_items = [(key, summary.quantiles(), summary.count, summary.sum) for key, summary in summaries.items()]
+        counter_items = list(counters.items())
+        gauge_items = list(gauges.items())
+    lines = []
+    typed = set()
+    for (name, labels), quantiles, count, total in sorted(summary_items):
+        if name not in typed:
+            lines.append("# TYPE {} summary".format(name))
+            typed.add(name)
+        for q, value in quantiles:
+            lines.append("{}{} {:.6f}".format(name, format_labels(labels, [("quantile", q)]), value))
+        lines.append("{}_sum{} {:.6f}".format(name, format_labels(labels), total))
+        lines.append("{}_count{} {}".format(name, format_labels(labels), count))
+    for (name, labels), value in sorted(counter_items):
+        if name not in typed:
+            lines.append("# TYPE {} counter".format(name))
+            typed.add(name)
+        lines.append("{}{} {}".format(name, format_labels(labels), value))
+    for (name, labels), value in sorted(gauge_items):
+        if name not in typed:
+            lines.append("# TYPE {} gauge".format(name))
+            typed.add(name)
+        lines.append("{}{} {}".format(name, format_labels(labels), value))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def write(path):
+    # replaced in one step, so a reader never sees half a file
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        file.write(render())
+    os.replace(temporary, path)
+
+
+def rss_bytes(pid="self"):
+    # resident memory of the process and all its children, the filter workers included
+    total = 0
+    try:
+        with open("/proc/{}/status".format(pid)) as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        for task in os.listdir("/proc/{}/task".format(pid)):
+            with open("/proc/{}/task/{}/children".format(pid, task)) as file:
+                total += sum(rss_bytes(child) for child in file.read().split())
+    except OSError:
+        pass
+    return total
+
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def sample_resources(paths):
+    set_gauge(RSS_BYTES, rss_bytes())
+    for path in paths:
+        if os.path.isdir(path):
+            set_gauge(DISK_BYTES, directory_bytes(path), path=path)
+            set_gauge(DISK_FREE_BYTES, shutil.disk_usage(path).free, path=path)
+
+
+def watch_resources(paths, interval=30):
+    # memory and disk use for soak tests, printed with the session p95
+    def run():
+        while True:
+            sample_resources(paths)
+            with lock:
+                values = dict(gauges)
+            p95 = quantile(SESSION_SECONDS, 0.95)
+            print("Speicher {:.0f} MB, {}, Sitzung p95 {}".format(
+                values[(RSS_BYTES, ())] / 2**20,
+                ", ".join("{} {:.0f} MB".format(dict(labels)["path"], value / 2**20)
+                          for (name, labels), value in sorted(values.items()) if name == DISK_BYTES),
+                "-" if p95 is None else "{:.2f}s".format(p95)
+            ))
+            sleep(interval)
+
+    threading.Thread(target=run, name="resources", daemon=True).start()
+
+
+def write_periodically(path, interval=10):
+    def run():
+        while True:
+            sleep(interval)
+            try:
+                write(path)
+            except OSError as error:
+                print("Metriken nicht geschrieben: {}".format(error))
+
+    threading.Thread(target=run, name="metrics file", daemon=True).start()
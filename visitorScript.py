@@ -0,0 +1,42 @@
+import random
+
+# coin and button events at seconds from the start, "end" stops the run
+EVENTS = ("coin", "button", "end")
+# seconds the booth still gets after the last visitor before a generated run ends
+DRAIN_SECONDS = 30
+
+
+def load(path):
+    # one "<seconds> <event>" per line, # starts a comment
+    events = []
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, start=1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            seconds, event = line.split()
+            if event not in EVENTS:
+                raise ValueError("{}:{}: unknown event {}".format(path, number, event))
+            events.append((float(seconds), event))
+    return sorted(events)
+
+
+def busy_evening(minutes, visitors_per_minute, seed=None):
+    # visitors arrive at random and queue while the booth is taken: coin, button for the
+    # countdown, a look at the previews, button for the QR code, button to go back
+    rng = random.Random(seed)
+    events = []
+    arrival = 0
+    free = 0
+    while True:
+        arrival += rng.expovariate(visitors_per_minute / 60)
+        if arrival > minutes * 60:
+            break
+        start = max(arrival, free)
+        countdown = start + rng.uniform(2, 6)
+        qr_code = countdown + 3 + rng.uniform(5, 15)
+        back = qr_code + rng.uniform(5, 15)
+        events += [(start, "coin"), (countdown, "button"), (qr_code, "button"), (back, "button")]
+        free = back + rng.uniform(1, 5)
+    events.append((max(free, minutes * 60) + DRAIN_SECONDS, "end"))
+    return events
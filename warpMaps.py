@@ -0,0 +1,255 @@
+import os
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import skimage as ski
+
+import captureCache
+import recipe
+
+# every distortion filter draws its random parameters from this many fixed presets
+PRESETS = 4
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "schnappi", "warps")
+# bump when the map format or a generator changes, old cache files are ignored then
+VERSION = 1
+# maps that depend on more than the frame size (e.g. the face position) are only kept in memory
+MEMORY_CACHE_SIZE = 8
+
+generators = {}
+loaded = {}
+recent = OrderedDict()
+lock = threading.Lock()
+# per thread buffers that are reused by every remap of the same size
+scratch = threading.local()
+
+
+def scratch_buffers(name, shape, dtype, count):
+    buffers = getattr(scratch, name, None)
+    if buffers is None or buffers[0].shape != shape:
+        buffers = [np.empty(shape, dtype=dtype) for _ in range(count)]
+        setattr(scratch, name, buffers)
+    return buffers
+
+
+def register(name, generator, mode='constant', cval=0):
+    # generator(shape, rng, *args) returns the (row, col) input coordinates for every output pixel
+    generators[name] = (generator, mode, cval)
+
+
+def swirl_mapping(xy, center, rotation, strength, radius):
+    # same as skimage.transform.swirl
+    x, y = xy.T
+    x0, y0 = center
+    rho = np.sqrt((x - x0) ** 2 + (y - y0) ** 2)
+    radius = radius / 5 * np.log(2)
+    theta = rotation + strength * np.exp(-rho / radius) + np.arctan2(y - y0, x - x0)
+    xy[..., 0] = x0 + rho * np.cos(theta)
+    xy[..., 1] = y0 + rho * np.sin(theta)
+    return xy
+
+
+def mirror(coords, size):
+    # skimage's 'reflect' mode: d c b | a b c d | c b a
+    period = 2 * (size - 1)
+    coords = np.abs(coords) % period
+    return np.where(coords > size - 1, period - coords, coords)
+
+
+LOW_LANES = np.uint32(0x00FF00FF)
+HIGH_LANES = np.uint32(0xFF00FF00)
+
+
+def lerp(a, b, weight):
+    # blends packed pixels two channels at a time, weight in 1/256
+    inverse = 256 - weight
+    low = (a & LOW_LANES) * inverse
+    low += (b & LOW_LANES) * weight
+    low >>= 8
+    low &= LOW_LANES
+    a >>= 8
+    a &= LOW_LANES
+    a *= inverse
+    b >>= 8
+    b &= LOW_LANES
+    b *= weight
+    a += b
+    a &= HIGH_LANES
+    a |= low
+    return a
+
+
+class WarpMap:
+    # bilinear remap in 8 bit fixed point: index of the top left neighbour in the
+    # frame padded by one pixel, and the row and column weights
+    def __init__(self, index, weights):
+        self.index = index
+        self.weights = weights
+
+    @classmethod
+    def from_coords(cls, coords, input_shape, mode):
+        rows, cols = input_shape
+        r, c = coords[0], coords[1]
+        if mode == 'reflect':
+            r, c = mirror(r, rows), mirror(c, cols)
+        r0, c0 = np.floor(r), np.floor(c)
+        weights = np.stack([r - r0, c - c0])
+        inside = (r0 >= -1) & (r0 <= rows - 1) & (c0 >= -1) & (c0 <= cols - 1)
+        index = ((r0 + 1) * (cols + 2) + (c0 + 1)).astype(np.int32)
+        # outside samples read the padding in the top left corner only
+        index[~inside] = 0
+        weights[:, ~inside] = 0
+        weights = np.clip(np.round(weights * 256), 0, 255).astype(np.uint8)
+        return cls(index, weights)
+
+    @property
+    def output_shape(self):
+        return self.index.shape
+
+    def scaled(self, full_shape, shape):
+        # the same mapping for an input of shape instead of full_shape, sampled from
+        # this map so a small render shows exactly what the full one will
+        width = full_shape[1] + 2
+        factor = (shape[0] / full_shape[0], shape[1] / full_shape[1])
+        output_shape = [max(1, round(size * f)) for size, f in zip(self.output_shape, factor)]
+        # nearest full size output pixel of every scaled one
+        rows = np.minimum(((np.arange(output_shape[0]) + 0.5) / factor[0]).astype(np.intp), self.output_shape[0] - 1)
+        cols = np.minimum(((np.arange(output_shape[1]) + 0.5) / factor[1]).astype(np.intp), self.output_shape[1] - 1)
+        index = np.asarray(self.index)[rows[:, np.newaxis], cols]
+        weights = np.asarray(self.weights)[:, rows[:, np.newaxis], cols] / 256
+        coords = np.stack([index // width - 1 + weights[0], index % width - 1 + weights[1]])
+        for axis in range(2):
+            coords[axis] = (coords[axis] + 0.5) * factor[axis] - 0.5
+        # samples outside the frame stay outside
+        coords[:, index == 0] = -2
+        return WarpMap.from_coords(coords, shape, 'constant')
+
+    def apply(self, image, cval=0):
+        if image.ndim == 2:
+            return self.apply(ski.color.gray2rgb(image), cval)[..., 0]
+        # pixels packed as 0x00BBGGRR, so every neighbour is a single gather
+        rows, cols = image.shape[:2]
+        padded, = scratch_buffers("padded", (rows + 2, cols + 2, 4), np.uint8, 1)
+        flat = padded.view(np.uint32).ravel()
+        flat.fill(cval * 0x010101)
+        # channel by channel is much faster than one strided copy
+        for channel in range(3):
+            padded[1:-1, 1:-1, channel] = image[..., channel]
+        width = cols + 2
+
+        wy = self.weights[0].astype(np.uint32)
+        wx = self.weights[1].astype(np.uint32)
+        neighbours = scratch_buffers("neighbours", self.output_shape, np.uint32, 4)
+        for neighbour, offset in zip(neighbours, (0, 1, width, width + 1)):
+            flat[offset:].take(self.index, out=neighbour, mode='clip')
+        top = lerp(neighbours[0], neighbours[1], wx)
+        bottom = lerp(neighbours[2], neighbours[3], wx)
+        packed = lerp(top, bottom, wy).view(np.uint8).reshape(self.output_shape + (4,))
+        out = np.empty(self.output_shape + (3,), dtype=np.uint8)
+        for channel in range(3):
+            out[..., channel] = packed[..., channel]
+        return out
+
+    def save(self, path):
+        # weights first, the index file marks a complete entry
+        for suffix, array in (("weights", self.weights), ("index", self.index)):
+            temp_path = "{}.{}.{}.npy".format(path, suffix, os.getpid())
+            np.save(temp_path, array)
+            os.replace(temp_path, "{}.{}.npy".format(path, suffix))
+
+    @classmethod
+    def load(cls, path):
+        index = np.load("{}.index.npy".format(path), mmap_mode='r')
+        weights = np.load("{}.weights.npy".format(path), mmap_mode='r')
+        return cls(index, weights)
+
+
+def preset_rng(name, preset):
+    # presets are the same on every boot, so their maps can be cached on disk
+    return random.Random("{}-{}-{}".format(name, preset, VERSION))
+
+
+def compute(name, shape, preset, *args):
+    generator, mode, _ = generators[name]
+    coords = generator(shape, preset_rng(name, preset), *args)
+    return WarpMap.from_coords(coords, shape, mode)
+
+
+def cache_path(name, shape, preset):
+    return os.path.join(CACHE_DIR, "{}-{}-{}x{}-v{}".format(name, preset, shape[0], shape[1], VERSION))
+
+
+def remembered(key, compute):
+    with lock:
+        if key in recent:
+            recent.move_to_end(key)
+            return recent[key]
+    result = compute()
+    with lock:
+        recent[key] = result
+        while len(recent) > MEMORY_CACHE_SIZE:
+            recent.popitem(last=False)
+    return result
+
+
+def stored(path, compute):
+    # the map saved at path, computed and saved first if it is not there yet,
+    # and whether it was there
+    try:
+        return WarpMap.load(path), True
+    except (OSError, ValueError):
+        pass
+    result = compute()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        result.save(path)
+        result = WarpMap.load(path)
+    except OSError:
+        pass
+    return result, False
+
+
+def warp_map(name, shape, preset, *args):
+    shape = tuple(shape[:2])
+    key = (name, shape, preset) + args
+    if args:
+        cache = captureCache.current()
+        if cache is None:
+            return remembered(key, lambda: compute(name, shape, preset, *args))
+        # the preview and the variants of a capture share its maps across the workers
+        path = cache.path("{}-{}-{}x{}-{}".format(name, preset, shape[0], shape[1], "_".join(str(value) for value in np.ravel(args))))
+        result, hit = stored(path, lambda: compute(name, shape, preset, *args))
+        cache.count(int(hit), int(not hit))
+        return result
+
+    result = loaded.get(key)
+    if result is not None:
+        return result
+    result, _ = stored(cache_path(name, shape, preset), lambda: compute(name, shape, preset))
+    loaded[key] = result
+    return result
+
+
+def scaled_warp_map(name, shape, full_shape, preset, *args):
+    shape = tuple(shape[:2])
+    key = ("scaled", name, shape, full_shape, preset) + args
+    return remembered(key, lambda: warp_map(name, full_shape, preset, *args).scaled(full_shape, shape))
+
+
+def apply_preset(name, image, *args, preset=None):
+    # args like the face position refer to the full frame of the recipe
+    if preset is None:
+        preset = recipe.rng().randrange(PRESETS)
+    cval = generators[name][2]
+    full_shape = recipe.full_shape(image.shape)
+    if full_shape == image.shape[:2]:
+        return warp_map(name, image.shape, preset, *args).apply(image, cval)
+    return scaled_warp_map(name, image.shape, full_shape, preset, *args).apply(image, cval)
+
+
+def prepare(shape):
+    # computes (or loads) every preset that only depends on the frame size
+    for name in generators:
+        for preset in range(PRESETS):
+            warp_map(name, shape, preset)